@@ -6,6 +6,17 @@ from tqdm import tqdm
 import time
 import logging
 import re
+import json
+import argparse
+from translation_memory import get_translation_memory, prompt_hash
+from translation_manifest import TranslationManifest
+from adaptive_limiter import AdaptiveLimiter
+from ollama_pool import EndpointPool, NoEndpointAvailable
+from single_flight import SingleFlight
+from cue_journal import CueJournal, journal_path, source_hash, atomic_write, outputs_current
+from ollama_stream import stream_options, num_predict_for, read_stream, uncapped, unusable, stream_stats
+from ollama_metrics import metrics, METRICS_SUMMARY_NAME
+from stage_profile import profiler, profiling, add_profile_arguments
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -13,8 +24,15 @@ logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(
 MAX_RETRIES = 3
 TIMEOUT = 60  # 1 minute
 MAX_CONCURRENT_FILES = 5  # Number of files to process in parallel
-MAX_CONCURRENT_REQUESTS = 10  # Number of concurrent API requests
+MAX_CONCURRENT_REQUESTS = 32  # Ceiling for the adaptive in-flight request limit of each Ollama host
 RATE_LIMIT = 10  # requests per second
+MODEL = "gemma2"
+PROMPT_TEMPLATE = "Translate the following Chinese text to {target_language}. Provide only the direct translation without any explanations or additional text:\n\n{text}"
+single_flight = SingleFlight()  # Shares one backend call between identical concurrent cues
+
+COMBINED_MODE = True  # One request returns every target language as JSON
+COMBINED_PROMPT_TEMPLATE = "Translate the following Chinese text to each of these languages: {languages}. Provide only the direct translations without any explanations or additional text, as a JSON object whose keys are the language codes {keys}:\n\n{text}"
+PROMPT_VERSION = prompt_hash(PROMPT_TEMPLATE + COMBINED_PROMPT_TEMPLATE)  # Changing a prompt retranslates
 
 class RateLimiter:
     def __init__(self, rate_limit):
@@ -24,11 +42,14 @@ class RateLimiter:
         self.lock = asyncio.Lock()
 
     async def acquire(self):
+        # Reserve a token under the lock (the balance may go negative) and sleep off
+        # the debt outside it, so waiters neither poll nor block each other
         async with self.lock:
-            while self.tokens < 1:
-                self._refill()
-                await asyncio.sleep(0.1)
+            self._refill()
             self.tokens -= 1
+            wait = -self.tokens / self.rate_limit if self.tokens < 0 else 0
+        if wait:
+            await asyncio.sleep(wait)
 
     def _refill(self):
         now = time.monotonic()
@@ -37,76 +58,261 @@ class RateLimiter:
         self.tokens = min(self.rate_limit, self.tokens + new_tokens)
         self.last_refill = now
 
-async def translate_text(session, text, target_language, rate_limiter, retries=0):
-    url = "http://localhost:11434/api/generate"
+async def translate_text(session, text, target_language, rate_limiter, pool):
+    key = (text, target_language, MODEL, PROMPT_TEMPLATE)
+    return await single_flight.do(key, lambda: _translate_text(session, text, target_language, rate_limiter, pool))
+
+async def _translate_text(session, text, target_language, rate_limiter, pool, retries=0, capped=False):
+    memory = get_translation_memory()
+    cached = memory.get(text, target_language, MODEL, PROMPT_TEMPLATE)
+    if cached is not None:
+        return cached
+
+    lines = text.count('\n') + 1
     payload = {
-        "model": "gemma2",
-        "prompt": f"Translate the following Chinese text to {target_language}. Provide only the direct translation without any explanations or additional text:\n\n{text}",
-        "stream": False
+        "model": MODEL,
+        "prompt": PROMPT_TEMPLATE.format(target_language=target_language, text=text),
+        **stream_options(text, lines)
     }
+    if capped:
+        payload = uncapped(payload)  # The budgeted attempt was cut off mid-translation
     
+    queued = time.monotonic()
     await rate_limiter.acquire()
     try:
-        async with session.post(url, json=payload, timeout=TIMEOUT) as response:
-            result = await response.json()
-            return result['response'].strip()
-    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+        async with pool.route(MODEL) as endpoint, endpoint.limiter.slot() as sample, \
+                session.post(endpoint.generate_url, json=payload, timeout=TIMEOUT) as response:
+            single_flight.executed()
+            started = time.monotonic()
+            result = await read_stream(response, lines, num_predict=payload["options"].get("num_predict"))
+            if not result.get('aborted'):
+                sample["result"] = result
+            elapsed = time.monotonic() - started
+            metrics.observe_generation(MODEL, result, elapsed, started - queued)
+            profiler.request(started - queued, elapsed, result)
+            if not unusable(result):
+                metrics.observe_retries(MODEL, retries)
+                translation = result['response'].strip()
+                memory.put(text, target_language, MODEL, PROMPT_TEMPLATE, translation)
+                return translation
+    except (aiohttp.ClientError, asyncio.TimeoutError, NoEndpointAvailable) as e:
+        if isinstance(e, asyncio.TimeoutError):
+            metrics.observe_timeout(MODEL)
         if retries < MAX_RETRIES:
             await asyncio.sleep(2 ** retries)  # Exponential backoff
-            return await translate_text(session, text, target_language, rate_limiter, retries + 1)
+            return await _translate_text(session, text, target_language, rate_limiter, pool, retries + 1, capped)
         else:
             logging.error(f"Failed to translate after {MAX_RETRIES} retries: {text[:50]}...")
+            metrics.observe_retries(MODEL, retries, failed=True)
             return f"TRANSLATION_FAILED: {text}"
 
+    # The reply ran into its length limit or held no translated line: never use or cache it
+    if capped or retries >= MAX_RETRIES:
+        logging.error(f"Translation cut off or malformed: {text[:50]}...")
+        metrics.observe_retries(MODEL, retries, failed=True)
+        return f"TRANSLATION_FAILED: {text}"
+    logging.warning(f"Translation cut off or malformed, retrying without the cap: {text[:50]}...")
+    return await _translate_text(session, text, target_language, rate_limiter, pool, retries + 1, capped=True)
+
+def parse_combined_response(response_text, target_languages):
+    """
+    Pull {lang: translation} out of a combined response, or None if any language is missing.
+    """
+    match = re.search(r'\{.*\}', response_text, re.DOTALL)
+    if not match:
+        return None
+    try:
+        result = json.loads(match.group(0))
+    except json.JSONDecodeError:
+        return None
+    if not isinstance(result, dict):
+        return None
+    translations = {}
+    for lang in target_languages:
+        value = result.get(lang)
+        if not isinstance(value, str) or not value.strip():
+            return None
+        translations[lang] = value.strip()
+    return translations
+
+async def translate_text_combined(session, text, target_languages, rate_limiter, pool):
+    """
+    Translate one cue into every target language with a single generation, falling back
+    to per-language translate_text calls when the combined response cannot be parsed.
+    """
+    key = (text, tuple(target_languages), MODEL, COMBINED_PROMPT_TEMPLATE)
+    return await single_flight.do(key, lambda: _translate_text_combined(session, text, target_languages, rate_limiter, pool))
+
+async def _translate_text_combined(session, text, target_languages, rate_limiter, pool, retries=0):
+    memory = get_translation_memory()
+    translations = {}
+    for lang in target_languages:
+        cached = memory.get(text, lang, MODEL, COMBINED_PROMPT_TEMPLATE)
+        if cached is None:
+            cached = memory.get(text, lang, MODEL, PROMPT_TEMPLATE)
+        if cached is not None:
+            translations[lang] = cached
+    missing = [lang for lang in target_languages if lang not in translations]
+    if len(missing) < 2:
+        for lang in missing:
+            translations[lang] = await translate_text(session, text, lang, rate_limiter, pool)
+        return translations
+
+    payload = {
+        "model": MODEL,
+        "prompt": COMBINED_PROMPT_TEMPLATE.format(
+            languages=', '.join(missing), keys=', '.join(f'"{lang}"' for lang in missing), text=text),
+        "format": "json",
+        "stream": True,
+        # The JSON reply has no line structure to stop on, only a length budget
+        "options": {"num_predict": num_predict_for(text) * len(missing)}
+    }
+
+    queued = time.monotonic()
+    await rate_limiter.acquire()
+    combined = None
+    try:
+        async with pool.route(MODEL) as endpoint, endpoint.limiter.slot() as sample, \
+                session.post(endpoint.generate_url, json=payload, timeout=TIMEOUT) as response:
+            single_flight.executed()
+            started = time.monotonic()
+            result = sample["result"] = await read_stream(response)
+            elapsed = time.monotonic() - started
+            metrics.observe_generation(MODEL, result, elapsed, started - queued)
+            metrics.observe_retries(MODEL, retries)
+            profiler.request(started - queued, elapsed, result)
+            # A capped JSON reply is partial: fall back to the per-language requests
+            if not result.get('capped'):
+                combined = parse_combined_response(result.get('response', ''), missing)
+    except (aiohttp.ClientError, asyncio.TimeoutError, NoEndpointAvailable) as e:
+        if isinstance(e, asyncio.TimeoutError):
+            metrics.observe_timeout(MODEL)
+        if retries < MAX_RETRIES:
+            await asyncio.sleep(2 ** retries)  # Exponential backoff
+            return await _translate_text_combined(session, text, target_languages, rate_limiter, pool, retries + 1)
+        metrics.observe_retries(MODEL, retries, failed=True)
+
+    if combined is None:
+        logging.warning(f"Combined translation unparseable, falling back to per-language requests: {text[:50]}...")
+        for lang in missing:
+            translations[lang] = await translate_text(session, text, lang, rate_limiter, pool)
+        return translations
+
+    for lang, translation in combined.items():
+        memory.put(text, lang, MODEL, COMBINED_PROMPT_TEMPLATE, translation)
+    translations.update(combined)
+    return translations
+
 def format_time(time_str):
     # Convert SRT time format to VTT format
     return re.sub(r'(\d{2}):(\d{2}):(\d{2}),(\d{3})', r'\1:\2:\3.\4', time_str)
 
-async def process_srt_file(session, file_path, target_languages, rate_limiter, semaphore):
+async def process_srt_file(session, manifest, file_path, target_languages, rate_limiter, pool, semaphore):
+    with profiler.file(file_path):
+        await _process_srt_file(session, manifest, file_path, target_languages, rate_limiter, pool, semaphore)
+
+async def _process_srt_file(session, manifest, file_path, target_languages, rate_limiter, pool, semaphore):
     async with semaphore:
         base_name = os.path.splitext(file_path)[0]
+        vtt_files = [f"{base_name}_{lang}.vtt" for lang in target_languages]
+        if outputs_current(manifest, file_path, vtt_files, MODEL, PROMPT_VERSION):
+            logging.info(f"Skipped file: {file_path} (already translated)")
+            return
         
-        async with aiofiles.open(file_path, 'r', encoding='utf-8') as f:
-            content = await f.read()
+        with profiler.stage("parse"):
+            async with aiofiles.open(file_path, 'r', encoding='utf-8') as f:
+                content = await f.read()
+
+        journal = CueJournal(journal_path(base_name), source_hash(content))
+        done = journal.load()
+        if done:
+            logging.info(f"Resuming {file_path}: {len(done)} cue translations recovered from journal")
+
+        def record(lang, cue, translation):
+            done[(lang, cue)] = translation
+            if not translation.startswith("TRANSLATION_FAILED"):
+                journal.record(lang, cue, translation)
+
+        async def translate_cue(cue, text, languages):
+            if COMBINED_MODE and len(languages) > 1:
+                translations = await translate_text_combined(session, text, languages, rate_limiter, pool)
+                for lang in languages:
+                    record(lang, cue, translations[lang])
+                return
+            translations = await asyncio.gather(
+                *(translate_text(session, text, lang, rate_limiter, pool) for lang in languages))
+            for lang, translation in zip(languages, translations):
+                record(lang, cue, translation)
         
-        lines = content.strip().split('\n')
-        translated_contents = {lang: [] for lang in target_languages}
+        with profiler.stage("parse"):
+            lines = content.strip().split('\n')
+            cues = []
+            tasks = []
+            for i in range(0, len(lines), 4):
+                block = lines[i:i+4]
+                if len(block) < 3:
+                    continue
+                
+                cue = i // 4
+                index, timing, text = block[:3]
+                formatted_timing = ' --> '.join(map(format_time, timing.split(' --> ')))
+                cues.append((cue, index, formatted_timing))
+
+                missing = [lang for lang in target_languages if (lang, cue) not in done]
+                if missing:
+                    tasks.append(asyncio.create_task(translate_cue(cue, text, missing)))
+
+        try:
+            await asyncio.gather(*tasks)
+        except BaseException:
+            for task in tasks:
+                task.cancel()
+            raise
+        finally:
+            journal.close()
         
-        tasks = []
-        for i in range(0, len(lines), 4):
-            block = lines[i:i+4]
-            if len(block) < 3:
-                continue
-            
-            index, timing, text = block[:3]
-            formatted_timing = ' --> '.join(map(format_time, timing.split(' --> ')))
-            
+        with profiler.stage("post-process"):
+            outputs = {}
             for lang in target_languages:
-                task = asyncio.create_task(translate_text(session, text, lang, rate_limiter))
-                tasks.append((index, formatted_timing, lang, task))
+                content = []
+                for cue, index, timing in cues:
+                    content.extend([index, timing, done[(lang, cue)], ''])
+                outputs[lang] = "WEBVTT\n\n" + '\n'.join(content)
+        with profiler.stage("write"):
+            for lang, vtt in outputs.items():
+                atomic_write(f"{base_name}_{lang}.vtt", vtt)
+            failed = sum(1 for translation in done.values() if translation.startswith("TRANSLATION_FAILED"))
+            if not failed:
+                journal.discard()
+                for vtt_file in vtt_files:
+                    manifest.record(file_path, vtt_file, MODEL, PROMPT_VERSION)
         
-        for index, timing, lang, task in tasks:
-            translation = await task
-            translated_contents[lang].extend([index, timing, translation, ''])
-        
-        for lang, content in translated_contents.items():
-            output_file = f"{base_name}_{lang}.vtt"
-            async with aiofiles.open(output_file, 'w', encoding='utf-8') as f:
-                await f.write("WEBVTT\n\n")
-                await f.write('\n'.join(content))
-        
-        logging.info(f"Processed file: {file_path}")
+        if failed:
+            # The journal stays, so the next run retranslates only the failed cues
+            logging.warning(f"Processed file: {file_path} ({failed} cue translations failed, kept for retry)")
+        else:
+            logging.info(f"Processed file: {file_path}")
 
-async def process_files(files):
+async def process_files(files, manifest):
     target_languages = ['en', 'vi']
     timeout = aiohttp.ClientTimeout(total=TIMEOUT)
     rate_limiter = RateLimiter(RATE_LIMIT)
     semaphore = asyncio.Semaphore(MAX_CONCURRENT_FILES)
     
+    pool = EndpointPool(limiter_factory=lambda: AdaptiveLimiter(max_limit=MAX_CONCURRENT_REQUESTS))
+    
     async with aiohttp.ClientSession(timeout=timeout) as session:
-        tasks = [process_srt_file(session, file, target_languages, rate_limiter, semaphore) for file in files]
-        for task in tqdm(asyncio.as_completed(tasks), total=len(tasks), desc="Processing files"):
-            await task
+        await pool.start(session)
+        try:
+            tasks = [process_srt_file(session, manifest, file, target_languages, rate_limiter, pool, semaphore) for file in files]
+            for task in tqdm(asyncio.as_completed(tasks), total=len(tasks), desc="Processing files"):
+                await task
+        finally:
+            await pool.stop()
+
+    pool.log_summary()
+    logging.info(f"Single-flight: {single_flight.summary()}")
+    logging.info(f"Streaming: {stream_stats.summary()}")
 
 def find_srt_files(directory):
     srt_files = []
@@ -135,12 +341,23 @@ async def main():
     
     logging.info(f"Found {len(srt_files)} SRT files to process.")
     
+    metrics.serve()
+    manifest = TranslationManifest(current_dir)
     start_time = time.time()
-    await process_files(srt_files)
+    try:
+        await process_files(srt_files, manifest)
+    finally:
+        manifest.close()
+        metrics.write_summary(os.path.join(current_dir, METRICS_SUMMARY_NAME))
     end_time = time.time()
     
     logging.info(f"Translation completed. VTT files have been created.")
     logging.info(f"Total processing time: {end_time - start_time:.2f} seconds")
 
 if __name__ == "__main__":
-    asyncio.run(main())
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Translate the SRT files in the current folder to English and Vietnamese VTT.")
+    add_profile_arguments(parser)
+    args = parser.parse_args()
+
+    with profiling(args):
+        asyncio.run(main())
\ No newline at end of file
@@ -0,0 +1,105 @@
+import time
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+
+# AIMD concurrency control for Ollama. Every finished request is scored by its
+# decode speed (seconds per generated token, from eval_duration) and by how long
+# it sat queued inside Ollama. While decode speed stays close to the best value
+# seen, the limit grows by about one slot per round of requests. When requests
+# start queueing, decode speed collapses as parallel slots fight over the GPU, or
+# requests fail, the limit is cut multiplicatively. It settles just below the
+# point where more requests stop adding throughput, whatever model is loaded.
+INITIAL_LIMIT = 2
+MIN_LIMIT = 1
+MAX_LIMIT = 32
+BACKOFF_FACTOR = 0.7  # Multiplicative decrease on congestion
+LATENCY_TOLERANCE = 1.6  # Sample / baseline ratio treated as congestion
+QUEUE_TOLERANCE = 2.0  # Seconds spent waiting inside Ollama before it counts as congestion
+BASELINE_DRIFT = 0.01  # How fast the baseline forgets an unusually fast sample
+
+class AdaptiveLimiter:
+    def __init__(self, initial=INITIAL_LIMIT, min_limit=MIN_LIMIT, max_limit=MAX_LIMIT,
+                 backoff=BACKOFF_FACTOR, tolerance=LATENCY_TOLERANCE, queue_tolerance=QUEUE_TOLERANCE):
+        self.limit = float(initial)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.backoff = backoff
+        self.tolerance = tolerance
+        self.queue_tolerance = queue_tolerance
+        self.in_flight = 0
+        self.baseline = None
+        self.completed = 0
+        self.congestion_events = 0
+        self._last_decrease = 0.0
+        self._cond = asyncio.Condition()
+
+    async def acquire(self):
+        async with self._cond:
+            await self._cond.wait_for(lambda: self.in_flight < int(self.limit))
+            self.in_flight += 1
+        return time.monotonic()
+
+    async def release(self, started, result=None, failed=False):
+        """
+        Hand a slot back and adjust the limit from the outcome. result is the decoded
+        Ollama response, whose eval_count and total_duration refine the sample.
+        """
+        elapsed = time.monotonic() - started
+        async with self._cond:
+            self.in_flight -= 1
+            self.completed += 1
+            if failed:
+                self._decrease(started, "request failed or timed out")
+            elif result is not None:
+                self._observe(started, elapsed, result)
+            self._cond.notify_all()
+
+    @asynccontextmanager
+    async def slot(self):
+        """
+        Hold a slot for one request. Yields a dict; store the Ollama response under
+        "result" so the limiter can learn from its timing fields.
+        """
+        sample = {"result": None}
+        started = await self.acquire()
+        try:
+            yield sample
+        except Exception:
+            await self.release(started, failed=True)
+            raise
+        except BaseException:
+            await self.release(started)
+            raise
+        await self.release(started, sample["result"])
+
+    def _observe(self, started, elapsed, result):
+        # Prefer Ollama's own decode timing: it is independent of prompt length and
+        # slows down as parallel slots contend for the GPU
+        tokens = result.get('eval_count', 0)
+        eval_seconds = result.get('eval_duration', 0) / 1e9
+        per_token = eval_seconds / tokens if tokens and eval_seconds else elapsed / max(tokens, 1)
+        server_seconds = result.get('total_duration', 0) / 1e9
+        queued = elapsed - server_seconds if server_seconds else 0.0
+
+        if self.baseline is None or per_token < self.baseline:
+            self.baseline = per_token
+        else:
+            self.baseline += (per_token - self.baseline) * BASELINE_DRIFT
+
+        if queued > self.queue_tolerance:
+            self._decrease(started, f"queued {queued:.1f}s inside Ollama")
+        elif per_token > self.baseline * self.tolerance:
+            self._decrease(started, f"{per_token * 1000:.0f}ms/token vs {self.baseline * 1000:.0f}ms baseline")
+        else:
+            self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+
+    def _decrease(self, started, reason):
+        # One cut per round trip: requests that started before the last cut
+        # were issued at the old limit and carry no new information
+        if started < self._last_decrease:
+            return
+        self._last_decrease = time.monotonic()
+        self.congestion_events += 1
+        self.limit = max(self.min_limit, self.limit * self.backoff)
+        logging.debug(f"Concurrency limit lowered to {self.limit:.1f} ({reason})")
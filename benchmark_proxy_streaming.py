@@ -0,0 +1,97 @@
+import sys
+import json
+import time
+import requests
+
+# Measures what the editor's /translate stream costs on the wire for a whole SRT
+# in one prompt (1,000 cues by default): bytes received, records, time to first
+# and last token. It also works out what the same stream would have cost in the
+# old format, where every record repeated the whole response so far, and how long
+# the client needs to parse each form.
+# Usage: python benchmark_proxy_streaming.py model [episode.srt] [max_cues]
+# (start ollama-server-python.py first)
+
+PROXY_URL = "http://127.0.0.1:5000/translate"
+TARGET_LANGUAGE = "Vietnamese"
+DEFAULT_CUES = 1000
+LINES = ["你好，我们走吧。", "他明天会回来吗？", "别担心，一切都会好的。", "这是我第一次来这里。", "快点，我们要迟到了！"]
+
+def synthetic_srt(cues):
+    blocks = []
+    for i in range(cues):
+        start, end = i * 3, i * 3 + 2
+        blocks.append(f"{i + 1}\n{start // 3600:02d}:{start // 60 % 60:02d}:{start % 60:02d},000 --> "
+                      f"{end // 3600:02d}:{end // 60 % 60:02d}:{end % 60:02d},500\n{LINES[i % len(LINES)]}\n")
+    return '\n'.join(blocks)
+
+def load_srt(srt_file, max_cues):
+    with open(srt_file, 'r', encoding='utf-8') as f:
+        blocks = f.read().strip().split('\n\n')
+    return '\n\n'.join(blocks[:max_cues]) + '\n'
+
+def build_prompt(srt_content):
+    return f"""You are a professional subtitle translator. Translate each subtitle from Chinese to {TARGET_LANGUAGE}, keeping the subtitle numbers and timestamps. Do not include any introductions, explanations, warnings or comments.
+
+Here's the SRT content to translate:
+
+{srt_content}
+
+Translate each subtitle, keeping the original format intact."""
+
+def parse_records(lines):
+    start_time = time.perf_counter()
+    for line in lines:
+        json.loads(line)
+    return time.perf_counter() - start_time
+
+def main():
+    if len(sys.argv) < 2:
+        print("Usage: python benchmark_proxy_streaming.py model [episode.srt] [max_cues]")
+        return
+    model = sys.argv[1]
+    max_cues = int(sys.argv[3]) if len(sys.argv) > 3 else DEFAULT_CUES
+    srt_content = load_srt(sys.argv[2], max_cues) if len(sys.argv) > 2 else synthetic_srt(max_cues)
+    print(f"Benchmarking {srt_content.count('-->')} cues with {model} through {PROXY_URL}")
+
+    start_time = time.perf_counter()
+    first_token = last_token = None
+    wire_bytes = 0
+    buffer = b''
+    records = []
+    with requests.post(PROXY_URL, json={"model": model, "prompt": build_prompt(srt_content)}, stream=True) as response:
+        response.raise_for_status()
+        for data in response.iter_content(chunk_size=None):
+            wire_bytes += len(data)
+            buffer += data
+            *lines, buffer = buffer.split(b'\n')
+            for line in lines:
+                if not line.strip():
+                    continue
+                record = json.loads(line)
+                if record.get('error'):
+                    print(f"Error from proxy: {record['error']}")
+                    return
+                if record.get('response'):
+                    last_token = time.perf_counter() - start_time
+                    first_token = first_token or last_token
+                records.append(record)
+
+    # The same stream as the old proxy sent it: the accumulated text in every record
+    accumulated = ''
+    old_lines = []
+    for record in records:
+        accumulated += record.get('response', '')
+        old_lines.append(json.dumps({"response": accumulated, **({"done": True} if record.get('done') else {})}))
+    old_bytes = sum(len(line.encode('utf-8')) + 1 for line in old_lines)
+    new_lines = [json.dumps(record) for record in records]
+
+    print(f"\n{len(records)} records, {len(accumulated)} characters translated")
+    print(f"time to first token: {first_token or 0:.2f}s, time to last token: {last_token or 0:.2f}s")
+    print(f"\n{'format':<12} {'bytes':>14} {'client parse':>13}")
+    print(f"{'delta':<12} {wire_bytes:>14} {parse_records(new_lines):>12.3f}s")
+    print(f"{'accumulated':<12} {old_bytes:>14} {parse_records(old_lines):>12.3f}s")
+    if wire_bytes:
+        print(f"\nDelta streaming sends {old_bytes / wire_bytes:.0f}x fewer bytes")
+
+if __name__ == "__main__":
+    main()
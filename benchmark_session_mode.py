@@ -0,0 +1,82 @@
+import sys
+import time
+import requests
+from ollama_session import OllamaSession, SESSION_WINDOW, SESSION_PROMPT_TEMPLATE
+from ollama_engine import KEEP_ALIVE
+from translate_multi_file_CN2VI_fix import MODEL, SYSTEM_PROMPT, PROMPT_TEMPLATE, parse_srt_blocks, cue_text_lines
+
+# Compares prompt_eval_count and wall time of the stateless per-cue prompts, with
+# the instructions inline in every prompt (the old layout) and in the cached
+# system prompt, against session mode, which chains cues on the KV context
+# returned by /api/generate. Bypasses the translation memory so every cue
+# actually reaches the model.
+# Usage: python benchmark_session_mode.py episode.srt [max_cues]
+
+OLLAMA_URL = "http://localhost:11434/api/generate"
+TARGET_LANGUAGE = "Vietnamese"
+
+def load_cues(srt_file, max_cues):
+    with open(srt_file, 'r', encoding='utf-8') as f:
+        subtitle_blocks = parse_srt_blocks(f.readlines())
+    subtitle_blocks = [block for block in subtitle_blocks if len(block) >= 2 and cue_text_lines(block)]
+    return subtitle_blocks[:max_cues]
+
+def run_stateless(subtitle_blocks, inline=False):
+    system = SYSTEM_PROMPT.format(target_language=TARGET_LANGUAGE)
+    prompt_eval_count = 0
+    start_time = time.time()
+    for i, block in enumerate(subtitle_blocks):
+        prev_lines = subtitle_blocks[i-1][2:] if i > 0 else []
+        next_lines = subtitle_blocks[i+1][2:] if i < len(subtitle_blocks) - 1 else []
+        text_lines = cue_text_lines(block)
+        context = f"Previous lines: {' '.join(prev_lines)}\nCurrent lines: {' '.join(text_lines)}\nNext lines: {' '.join(next_lines)}"
+        prompt = PROMPT_TEMPLATE.format(context=context)
+        data = {
+            "model": MODEL,
+            "prompt": f"{system}\n\n{prompt}" if inline else prompt,
+            "stream": False,
+            "keep_alive": KEEP_ALIVE
+        }
+        if not inline:
+            data["system"] = system
+        response = requests.post(OLLAMA_URL, json=data)
+        prompt_eval_count += response.json().get('prompt_eval_count', 0)
+    return prompt_eval_count, time.time() - start_time
+
+def run_session(subtitle_blocks):
+    session = OllamaSession(MODEL, SESSION_PROMPT_TEMPLATE.format(target_language=TARGET_LANGUAGE), SESSION_WINDOW, OLLAMA_URL)
+    start_time = time.time()
+    for block in subtitle_blocks:
+        session.generate('\n'.join(cue_text_lines(block)))
+    return session.prompt_eval_count, time.time() - start_time
+
+def main():
+    if len(sys.argv) < 2:
+        print("Usage: python benchmark_session_mode.py episode.srt [max_cues]")
+        return
+    max_cues = int(sys.argv[2]) if len(sys.argv) > 2 else 100
+    subtitle_blocks = load_cues(sys.argv[1], max_cues)
+    print(f"Benchmarking {len(subtitle_blocks)} cues with {MODEL} (session window {SESSION_WINDOW})")
+
+    # Warm the model up so load time does not count against the first mode
+    requests.post(OLLAMA_URL, json={"model": MODEL, "prompt": "你好", "stream": False, "keep_alive": KEEP_ALIVE})
+
+    results = {
+        "inline": run_stateless(subtitle_blocks, inline=True),
+        "system": run_stateless(subtitle_blocks),
+        "session": run_session(subtitle_blocks),
+    }
+
+    print(f"\n{'mode':<10} {'prompt_eval_count':>18} {'per cue':>9} {'wall time':>10}")
+    for mode, (prompt_eval_count, elapsed) in results.items():
+        per_cue = prompt_eval_count / max(len(subtitle_blocks), 1)
+        print(f"{mode:<10} {prompt_eval_count:>18} {per_cue:>9.1f} {elapsed:>9.2f}s")
+
+    inline_tokens, inline_time = results["inline"]
+    for mode in ("system", "session"):
+        tokens, elapsed = results[mode]
+        if tokens and elapsed:
+            print(f"{mode}: prompt tokens reduced {inline_tokens / tokens:.1f}x, wall time {inline_time / elapsed:.2f}x faster than inline")
+
+if __name__ == "__main__":
+    main()
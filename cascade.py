@@ -0,0 +1,73 @@
+import re
+from collections import Counter
+from token_estimate import CJK_RE
+
+# Small-model-first cascade: a fast model translates every cue, the cheap checks
+# below score its output, and only the cues that fail one are sent again to the
+# large model. The thresholds are tuned for Chinese -> Vietnamese subtitles.
+SMALL_MODEL = "gemma2:2b-instruct-q8_0"
+CJK_RESIDUE_MAX = 0.2  # Share of CJK characters left in a translation (a name kept in Hanzi is fine)
+LENGTH_RATIO_MIN = 0.5  # Translation characters per source character
+LENGTH_RATIO_MAX = 10.0  # ... Vietnamese usually runs 2-4x the length of the Chinese
+LENGTH_CHECK_MIN_CHARS = 4  # Shorter sources ("嗯", "好") have no meaningful ratio
+REFUSAL_RE = re.compile(
+    r"\b(i cannot|i can't|i'm sorry|as an ai|here is|here's|translation:|note:|explanation|"
+    r"xin lỗi, tôi|tôi không thể|dưới đây là|bản dịch)", re.IGNORECASE)
+
+def check_translation(source_lines, translated_lines):
+    """
+    Return the list of checks a translation fails (empty if it looks usable).
+    """
+    problems = []
+    if translated_lines is None:
+        return ["no reply"]
+    lines = [line for line in translated_lines if line.strip()]
+    if len(lines) != len(source_lines):
+        problems.append("line count")
+
+    source = ''.join(''.join(source_lines).split())
+    text = ''.join(''.join(lines).split())
+    if not text:
+        return problems + ["empty"]
+    if len(CJK_RE.findall(text)) / len(text) > CJK_RESIDUE_MAX:
+        problems.append("cjk residue")
+    if len(source) >= LENGTH_CHECK_MIN_CHARS and not LENGTH_RATIO_MIN <= len(text) / len(source) <= LENGTH_RATIO_MAX:
+        problems.append("length ratio")
+    if REFUSAL_RE.search(' '.join(lines)):
+        problems.append("refusal/explanation")
+    return problems
+
+class CascadeStats:
+    def __init__(self):
+        self.checked = 0
+        self.escalated = 0
+        self.reasons = Counter()
+
+    def record(self, problems):
+        self.checked += 1
+        if problems:
+            self.escalated += 1
+            self.reasons.update(problems)
+        return not problems
+
+    @property
+    def escalation_rate(self):
+        return self.escalated / self.checked if self.checked else 0.0
+
+    def speedup(self, small_seconds, large_seconds):
+        """
+        Estimated speedup over sending every cue to the large model, from the
+        model time spent on each side (None until some cue has escalated).
+        """
+        if not self.escalated or not small_seconds + large_seconds:
+            return None
+        return self.checked * (large_seconds / self.escalated) / (small_seconds + large_seconds)
+
+    def summary(self, small_seconds=0.0, large_seconds=0.0):
+        reasons = ', '.join(f"{reason} {count}" for reason, count in self.reasons.most_common()) or "none"
+        speedup = self.speedup(small_seconds, large_seconds)
+        speedup = f"{speedup:.2f}x" if speedup is not None else "n/a"
+        return (f"{self.checked} cues through the small model, {self.escalated} escalated "
+                f"({self.escalation_rate:.1%}; {reasons}), estimated speedup {speedup}")
+
+cascade_stats = CascadeStats()
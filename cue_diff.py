@@ -0,0 +1,70 @@
+import hashlib
+from difflib import SequenceMatcher
+
+# Diff mode: when an SRT is edited, line up its cues with the version the existing
+# output was made from and carry over the translations of the cues that did not
+# change. The manifest keeps, per output, the (text hash, line count, failed) of
+# every cue it wrote, which is enough to cut the old VTT back into cues and to
+# align them. Failed cues were written with their source text and are never reused.
+
+def cue_hash(text_lines):
+    return hashlib.sha1('\n'.join(text_lines).encode('utf-8')).hexdigest()[:16]
+
+def align_cues(old_hashes, new_hashes):
+    """
+    Return {new position: old position} for cues whose text is unchanged. Runs of
+    equal hashes are matched in order, so inserted, removed or edited cues shift
+    the rest of the file without breaking the alignment.
+    """
+    matcher = SequenceMatcher(None, old_hashes, new_hashes, autojunk=False)
+    mapping = {}
+    for old_start, new_start, size in matcher.get_matching_blocks():
+        for k in range(size):
+            mapping[new_start + k] = old_start + k
+    return mapping
+
+def read_vtt_cues(path, line_counts):
+    """
+    Split a VTT written by the translators back into per-cue text lines, taking
+    line_counts[n] lines after the n-th timestamp. Returns None if the file no
+    longer has the expected shape (missing, cue count changed).
+    """
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            lines = f.read().split('\n')
+    except (OSError, UnicodeDecodeError):
+        return None
+
+    cues = []
+    i = 0
+    for count in line_counts:
+        while i < len(lines) and '-->' not in lines[i]:
+            i += 1
+        if i >= len(lines):
+            return None
+        cues.append(lines[i+1:i+1+count])
+        i += 1 + count
+    if any('-->' in line for line in lines[i:]):
+        return None
+    return cues
+
+def cue_failed(cue):
+    # Manifests written before the flag existed list (hash, line count) only
+    return len(cue) > 2 and bool(cue[2])
+
+def reusable_translations(previous, output_path, cue_lines):
+    """
+    Map cue index -> translated lines for every cue of cue_lines (None entries are
+    skipped) that is unchanged since the output was written and was translated
+    then. previous is the manifest's [(hash, line count, failed), ...] for that output.
+    """
+    if not previous:
+        return {}
+    old_cues = read_vtt_cues(output_path, [cue[1] for cue in previous])
+    if old_cues is None:
+        return {}
+    positions = [i for i, lines in enumerate(cue_lines) if lines is not None]
+    new_hashes = [cue_hash(cue_lines[i]) for i in positions]
+    mapping = align_cues([cue[0] for cue in previous], new_hashes)
+    return {positions[new]: old_cues[old] for new, old in mapping.items()
+            if cue_lines[positions[new]] and not cue_failed(previous[old])}
@@ -0,0 +1,101 @@
+import os
+import json
+import time
+import hashlib
+
+# Append-only record of finished cues for one source file. Long runs write every
+# completed cue here (fsynced in batches), so a crash or kill only loses the last
+# few cues: on restart the journal is replayed and those cues are skipped. The
+# VTT outputs are written atomically from the finished set and the journal is
+# removed last, so an output with no journal next to it is always complete.
+JOURNAL_SUFFIX = '.journal.jsonl'
+FSYNC_EVERY = 25  # Records between fsyncs
+FSYNC_INTERVAL = 5.0  # ... or seconds, whichever comes first
+
+def journal_path(base_name):
+    return base_name + JOURNAL_SUFFIX
+
+def source_hash(content):
+    return hashlib.sha1(content.encode('utf-8')).hexdigest()
+
+def outputs_current(manifest, input_path, output_paths, model, prompt_version):
+    """
+    True when every output was written by a finished run from the current content
+    of input_path: no journal is left beside them (that run was interrupted or
+    had failed cues, so it is resumed) and the manifest vouches for each one (an
+    edited SRT is retranslated).
+    """
+    if os.path.exists(journal_path(os.path.splitext(input_path)[0])):
+        return False
+    return all(manifest.is_current(input_path, path, model, prompt_version) for path in output_paths)
+
+def atomic_write(path, content):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        f.write(content)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+class CueJournal:
+    def __init__(self, path, source, fsync_every=FSYNC_EVERY, fsync_interval=FSYNC_INTERVAL):
+        self.path = path
+        self.source = source
+        self.fsync_every = fsync_every
+        self.fsync_interval = fsync_interval
+        self._file = None
+        self._unsynced = 0
+        self._last_sync = time.monotonic()
+
+    def load(self):
+        """
+        Return {(lang, cue): text} for cues finished by an earlier run and reopen the
+        journal for appending. A journal written for a different version of the
+        source is thrown away.
+        """
+        done = {}
+        if os.path.exists(self.path):
+            with open(self.path, 'r', encoding='utf-8') as f:
+                try:
+                    valid = json.loads(f.readline()).get('source') == self.source
+                except json.JSONDecodeError:
+                    valid = False
+                for line in f if valid else []:
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:
+                        break  # Torn final write from a crash
+                    done[(record['lang'], record['cue'])] = record['text']
+
+        # Rewrite what survived so a torn tail never precedes new records
+        lines = [json.dumps({"source": self.source})]
+        lines += [json.dumps({"lang": lang, "cue": cue, "text": text}, ensure_ascii=False)
+                  for (lang, cue), text in done.items()]
+        atomic_write(self.path, '\n'.join(lines) + '\n')
+        self._file = open(self.path, 'a', encoding='utf-8')
+        return done
+
+    def record(self, lang, cue, text):
+        self._file.write(json.dumps({"lang": lang, "cue": cue, "text": text}, ensure_ascii=False) + '\n')
+        self._unsynced += 1
+        if self._unsynced >= self.fsync_every or time.monotonic() - self._last_sync >= self.fsync_interval:
+            self.sync()
+
+    def sync(self):
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._unsynced = 0
+        self._last_sync = time.monotonic()
+
+    def close(self):
+        if self._file is not None:
+            self.sync()
+            self._file.close()
+            self._file = None
+
+    def discard(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        if os.path.exists(self.path):
+            os.remove(self.path)
@@ -1,7 +1,8 @@
 import os
 import re
-import html
 from google.cloud import translate_v2 as translate
+from google_batch_translate import translate_texts, MODEL
+from translation_manifest import TranslationManifest
 from concurrent.futures import ThreadPoolExecutor, as_completed
 from tqdm import tqdm
 
@@ -9,11 +10,6 @@ def get_translate_client():
     translate_client = translate.Client()
     return translate_client
 
-def translate_text(translate_client, text, target_language):
-    result = translate_client.translate(text, target_language=target_language)
-    translated_text = result['translatedText']
-    return html.unescape(translated_text)
-
 def srt_to_vtt(srt_content):
     vtt_content = "WEBVTT\n\n"
     vtt_content += srt_content.replace(',', '.')
@@ -24,34 +20,38 @@ def translate_srt_file_to_vtt(translate_client, file_path, target_language):
         content = file.read()
     
     srt_blocks = re.split(r'(\d+\n\d{2}:\d{2}:\d{2},\d{3} --> \d{2}:\d{2}:\d{2},\d{3}\n)', content)
-    translated_blocks = []
-
-    for i in range(1, len(srt_blocks), 2):
-        translated_text = translate_text(translate_client, srt_blocks[i + 1], target_language)
-        translated_blocks.append(srt_blocks[i] + translated_text + '\n')
+    headers = srt_blocks[1::2]
+    texts = srt_blocks[2::2]
+    translated_texts = translate_texts(translate_client, texts, target_language)
+    translated_blocks = [header + translated_text + '\n' for header, translated_text in zip(headers, translated_texts)]
     
     translated_srt_content = ''.join(translated_blocks)
     return srt_to_vtt(translated_srt_content)
 
-def process_file(translate_client, folder_path, file_name):
+def process_file(translate_client, manifest, folder_path, file_name):
     base_name = os.path.splitext(file_name)[0]
     srt_file = os.path.join(folder_path, base_name + '.srt')
     en_vtt_file = os.path.join(folder_path, base_name + '_en.vtt')
     vn_vtt_file = os.path.join(folder_path, base_name + '_vn.vtt')
 
-    if os.path.exists(en_vtt_file) and os.path.exists(vn_vtt_file):
-        return f"Skipping {file_name}: EN and VN translation files already exist."
+    # The manifest tells a finished translation of this exact SRT from a stale or truncated one
+    en_current = manifest.is_current(srt_file, en_vtt_file, MODEL, '')
+    vn_current = manifest.is_current(srt_file, vn_vtt_file, MODEL, '')
+    if en_current and vn_current:
+        return f"Skipping {file_name}: EN and VN translations are up to date."
 
     if os.path.exists(srt_file):
-        if not os.path.exists(en_vtt_file):
+        if not en_current:
             translated_content_en = translate_srt_file_to_vtt(translate_client, srt_file, 'en')
             with open(en_vtt_file, 'w', encoding='utf-8') as file:
                 file.write(translated_content_en)
+            manifest.record(srt_file, en_vtt_file, MODEL, '')
         
-        if not os.path.exists(vn_vtt_file):
+        if not vn_current:
             translated_content_vn = translate_srt_file_to_vtt(translate_client, srt_file, 'vi')
             with open(vn_vtt_file, 'w', encoding='utf-8') as file:
                 file.write(translated_content_vn)
+            manifest.record(srt_file, vn_vtt_file, MODEL, '')
         
         return f"Translated {file_name} to English and Vietnamese."
     else:
@@ -60,11 +60,12 @@ def process_file(translate_client, folder_path, file_name):
 def main():
     folder_path = os.getcwd()
     translate_client = get_translate_client()
+    manifest = TranslationManifest(folder_path)
 
     mp4_files = [file_name for file_name in os.listdir(folder_path) if file_name.endswith('.mp4')]
 
     with ThreadPoolExecutor() as executor:
-        futures = [executor.submit(process_file, translate_client, folder_path, file_name) for file_name in mp4_files]
+        futures = [executor.submit(process_file, translate_client, manifest, folder_path, file_name) for file_name in mp4_files]
         for future in tqdm(as_completed(futures), total=len(futures), desc="Translating files"):
             print(future.result())
 
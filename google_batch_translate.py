@@ -0,0 +1,52 @@
+import html
+from translation_memory import get_translation_memory
+from stage_profile import profiler
+
+# Google Translate v2 accepts a list of segments per request. Packing a file's
+# subtitle blocks into a few requests replaces one round trip per block.
+MODEL = "google-translate-v2"
+MAX_SEGMENTS = 128  # Segment limit of a single v2 request
+MAX_CHARS = 30000  # Keep requests well below the v2 payload limit
+
+def pack_segments(texts, max_segments=MAX_SEGMENTS, max_chars=MAX_CHARS):
+    batches = []
+    current = []
+    current_chars = 0
+    for text in texts:
+        if current and (len(current) >= max_segments or current_chars + len(text) > max_chars):
+            batches.append(current)
+            current = []
+            current_chars = 0
+        current.append(text)
+        current_chars += len(text)
+    if current:
+        batches.append(current)
+    return batches
+
+def translate_texts(translate_client, texts, target_language):
+    """
+    Translate a list of texts with as few API calls as possible and return the
+    translations in the same order. Identical texts are sent once, and texts
+    already in the translation memory are not sent at all.
+    """
+    memory = get_translation_memory()
+    translations = {}
+    pending = []
+    for text in dict.fromkeys(texts):
+        cached = memory.get(text, target_language, MODEL)
+        if cached is not None:
+            translations[text] = cached
+        elif text.strip():
+            pending.append(text)
+        else:
+            translations[text] = text
+
+    for batch in pack_segments(pending):
+        with profiler.stage("network"):  # Google reports no model time: the whole round trip counts here
+            results = translate_client.translate(batch, target_language=target_language)
+        for text, result in zip(batch, results):
+            translated_text = html.unescape(result['translatedText'])
+            translations[text] = translated_text
+            memory.put(text, target_language, MODEL, '', translated_text)
+
+    return [translations[text] for text in texts]
@@ -1,5 +1,5 @@
 import os
-from tqdm import tqdm
+from media_inventory import load_inventory
 
 def check_files(root_dir='.'):
     missing_files = {
@@ -9,30 +9,28 @@ def check_files(root_dir='.'):
     }
     small_files = []
 
-    total_files = sum([len(files) for _, _, files in os.walk(root_dir)])
-
-    with tqdm(total=total_files, desc="Processing files") as pbar:
-        for folder, _, files in os.walk(root_dir):
-            mp4_files = {os.path.splitext(file)[0] for file in files if file.endswith('.mp4')}
-            srt_files = {os.path.splitext(file)[0] for file in files if file.endswith('.srt')}
-            en_vtt_files = {os.path.splitext(file)[0].replace('_en', '') for file in files if file.endswith('_en.vtt')}
-            vn_vtt_files = {os.path.splitext(file)[0].replace('_vn', '') for file in files if file.endswith('_vn.vtt')}
-
-            for mp4_file in mp4_files:
-                if mp4_file not in srt_files:
-                    missing_files['missing_srt'].append(os.path.join(folder, mp4_file + '.mp4'))
-                if mp4_file not in en_vtt_files:
-                    missing_files['missing_en_vtt'].append(os.path.join(folder, mp4_file + '.mp4'))
-                if mp4_file not in vn_vtt_files:
-                    missing_files['missing_vn_vtt'].append(os.path.join(folder, mp4_file + '.mp4'))
-            
-            for file in files:
-                if file.endswith('.srt') or file.endswith('.vtt'):
-                    file_path = os.path.join(folder, file)
-                    if os.path.getsize(file_path) < 320:
-                        small_files.append(file_path)
-                
-                pbar.update(1)
+    inventory = load_inventory(root_dir)
+
+    for title in inventory.titles():
+        if title['mp4'] is None:
+            continue
+        mp4_path = title['mp4']['path']
+        if title['srt'] is None:
+            missing_files['missing_srt'].append(mp4_path)
+        if title['en_vtt'] is None:
+            missing_files['missing_en_vtt'].append(mp4_path)
+        if title['vn_vtt'] is None:
+            missing_files['missing_vn_vtt'].append(mp4_path)
+
+    for suffix in ('.srt', '.vtt'):
+        for file_path, _, _ in inventory.files(suffix):
+            # Stat every candidate: a file truncated in place leaves its folder's mtime,
+            # and so its cached size, unchanged
+            try:
+                if os.path.getsize(file_path) < 320:
+                    small_files.append(file_path)
+            except OSError:
+                continue  # Removed since the inventory was refreshed
 
     return missing_files, small_files
 
@@ -5,6 +5,9 @@ import aiofiles
 from tqdm import tqdm
 import time
 import logging
+from translation_memory import get_translation_memory, prompt_hash
+from translation_manifest import TranslationManifest
+from cue_journal import CueJournal, journal_path, source_hash, atomic_write, outputs_current
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -12,19 +15,29 @@ logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(
 MAX_RETRIES = 3
 TIMEOUT = 60  # 1 minute
 RATE_LIMIT = 1  # requests per second
+MODEL = "llama3"
+PROMPT_TEMPLATE = "Translate the following Chinese text to {target_language}: {text}"
+PROMPT_VERSION = prompt_hash(PROMPT_TEMPLATE)  # Changing the prompt retranslates
 
 async def translate_text(session, text, target_language, retries=0):
     url = "http://localhost:11434/api/generate"
+    memory = get_translation_memory()
+    cached = memory.get(text, target_language, MODEL, PROMPT_TEMPLATE)
+    if cached is not None:
+        return cached
+
     payload = {
-        "model": "llama3",
-        "prompt": f"Translate the following Chinese text to {target_language}: {text}",
+        "model": MODEL,
+        "prompt": PROMPT_TEMPLATE.format(target_language=target_language, text=text),
         "stream": False
     }
     
     try:
         async with session.post(url, json=payload, timeout=TIMEOUT) as response:
             result = await response.json()
-            return result['response'].strip()
+            translation = result['response'].strip()
+            memory.put(text, target_language, MODEL, PROMPT_TEMPLATE, translation)
+            return translation
     except (aiohttp.ClientError, asyncio.TimeoutError) as e:
         if retries < MAX_RETRIES:
             await asyncio.sleep(2 ** retries)  # Exponential backoff
@@ -33,44 +46,72 @@ async def translate_text(session, text, target_language, retries=0):
             logging.error(f"Failed to translate after {MAX_RETRIES} retries: {text[:50]}...")
             return f"TRANSLATION_FAILED: {text}"
 
-async def process_srt_file(session, file_path, target_languages):
+async def process_srt_file(session, manifest, file_path, target_languages):
     base_name = os.path.splitext(file_path)[0]
+    vtt_files = [f"{base_name}_{lang}.vtt" for lang in target_languages]
+    if outputs_current(manifest, file_path, vtt_files, MODEL, PROMPT_VERSION):
+        logging.info(f"Skipped file: {file_path} (already translated)")
+        return
     
     async with aiofiles.open(file_path, 'r', encoding='utf-8') as f:
         content = await f.read()
+
+    journal = CueJournal(journal_path(base_name), source_hash(content))
+    done = journal.load()
+    if done:
+        logging.info(f"Resuming {file_path}: {len(done)} cue translations recovered from journal")
     
     lines = content.strip().split('\n')
     translated_contents = {lang: [] for lang in target_languages}
+    failed = 0
     
-    for i in range(0, len(lines), 4):
-        block = lines[i:i+4]
-        if len(block) < 3:
-            continue
-        
-        index, timing, text = block[:3]
-        
-        for lang in target_languages:
-            translation = await translate_text(session, text, lang)
-            translated_contents[lang].extend([index, timing, translation, ''])
-        
-        await asyncio.sleep(1 / RATE_LIMIT)  # Simple rate limiting
+    try:
+        for i in range(0, len(lines), 4):
+            block = lines[i:i+4]
+            if len(block) < 3:
+                continue
+            
+            cue = i // 4
+            index, timing, text = block[:3]
+            requested = False
+            
+            for lang in target_languages:
+                translation = done.get((lang, cue))
+                if translation is None:
+                    translation = await translate_text(session, text, lang)
+                    requested = True
+                    if translation.startswith("TRANSLATION_FAILED"):
+                        failed += 1
+                    else:
+                        journal.record(lang, cue, translation)
+                translated_contents[lang].extend([index, timing, translation, ''])
+            
+            if requested:
+                await asyncio.sleep(1 / RATE_LIMIT)  # Simple rate limiting
+    finally:
+        journal.close()
     
     for lang, content in translated_contents.items():
         output_file = f"{base_name}_{lang}.vtt"
-        async with aiofiles.open(output_file, 'w', encoding='utf-8') as f:
-            await f.write("WEBVTT\n\n")
-            await f.write('\n'.join(content))
+        atomic_write(output_file, "WEBVTT\n\n" + '\n'.join(content))
+    if failed:
+        # The journal stays, so the next run retranslates only the failed cues
+        logging.warning(f"Processed file: {file_path} ({failed} cue translations failed, kept for retry)")
+        return
+    journal.discard()
+    for vtt_file in vtt_files:
+        manifest.record(file_path, vtt_file, MODEL, PROMPT_VERSION)
     
     logging.info(f"Processed file: {file_path}")
 
-async def process_files(files):
+async def process_files(files, manifest):
     target_languages = ['en', 'vi']
     timeout = aiohttp.ClientTimeout(total=TIMEOUT)
     
     async with aiohttp.ClientSession(timeout=timeout) as session:
         for file in tqdm(files, desc="Processing files"):
             try:
-                await process_srt_file(session, file, target_languages)
+                await process_srt_file(session, manifest, file, target_languages)
             except Exception as e:
                 logging.error(f"Error processing file {file}: {e}")
 
@@ -101,8 +142,12 @@ async def main():
     
     logging.info(f"Found {len(srt_files)} SRT files to process.")
     
+    manifest = TranslationManifest(current_dir)
     start_time = time.time()
-    await process_files(srt_files)
+    try:
+        await process_files(srt_files, manifest)
+    finally:
+        manifest.close()
     end_time = time.time()
     
     logging.info(f"Translation completed. VTT files have been created.")
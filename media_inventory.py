@@ -0,0 +1,133 @@
+import os
+import json
+from cue_journal import atomic_write
+
+# One index of the media library, shared by list_missing_files.py, the SRT copier
+# and the translators instead of each walking the tree on its own. The tree is
+# read with a single os.scandir pass and cached next to it; on the next run a
+# directory whose mtime has not changed is taken from the cache after one stat,
+# so only folders where files were added, removed or renamed are listed again.
+#
+# A directory's mtime does not change when a file in it is rewritten in place,
+# so sizes and mtimes of such files can be stale until the folder changes or a
+# full refresh is done.
+INVENTORY_NAME = '.media_inventory.json'
+INVENTORY_VERSION = 1
+POSTER_NAME = '0.jpg'
+
+# Per-title files, by the suffix that follows the title's name
+TITLE_SUFFIXES = {
+    'mp4': '.mp4',
+    'srt': '.srt',
+    'en_vtt': '_en.vtt',
+    'vn_vtt': '_vn.vtt',
+    'vi_vtt': '_vi.vtt',
+}
+
+class MediaInventory:
+    def __init__(self, root, cache_path=None):
+        self.root = os.path.abspath(root)
+        self.cache_path = cache_path or os.path.join(self.root, INVENTORY_NAME)
+        self.dirs = {}  # relative dir -> {"mtime_ns", "subdirs": [...], "files": {name: [size, mtime_ns]}}
+        self.scanned = 0  # Directories listed by the last refresh (the rest came from the cache)
+
+    def load(self):
+        try:
+            with open(self.cache_path, 'r', encoding='utf-8') as f:
+                cached = json.load(f)
+            if cached.get('version') == INVENTORY_VERSION and cached.get('root') == self.root:
+                self.dirs = cached['dirs']
+        except (OSError, ValueError, KeyError):
+            self.dirs = {}
+        return self
+
+    def save(self):
+        atomic_write(self.cache_path, json.dumps({"version": INVENTORY_VERSION, "root": self.root, "dirs": self.dirs}))
+
+    def refresh(self, full=False):
+        """
+        Bring the index up to date with the tree. Unchanged directories cost one
+        stat each; with full=True every directory is listed again.
+        """
+        old_dirs = self.dirs
+        self.dirs = {}
+        self.scanned = 0
+        stack = [('.', os.stat(self.root).st_mtime_ns)]
+        while stack:
+            rel, mtime_ns = stack.pop()
+            cached = old_dirs.get(rel)
+            if not full and cached is not None and cached['mtime_ns'] == mtime_ns:
+                entry = cached
+                for name in entry['subdirs']:
+                    try:
+                        stack.append((self._join(rel, name), os.stat(self.path(rel, name)).st_mtime_ns))
+                    except OSError:
+                        pass
+            else:
+                entry = self._scan(rel, mtime_ns, stack)
+            self.dirs[rel] = entry
+        return self
+
+    def _scan(self, rel, mtime_ns, stack):
+        self.scanned += 1
+        entry = {"mtime_ns": mtime_ns, "subdirs": [], "files": {}}
+        try:
+            with os.scandir(self.path(rel)) as it:
+                for item in it:
+                    try:
+                        if item.is_dir(follow_symlinks=False):
+                            entry['subdirs'].append(item.name)
+                            stack.append((self._join(rel, item.name), item.stat(follow_symlinks=False).st_mtime_ns))
+                        elif item.is_file() and item.name != os.path.basename(self.cache_path):
+                            stat = item.stat()
+                            entry['files'][item.name] = [stat.st_size, stat.st_mtime_ns]
+                    except OSError:
+                        continue  # Vanished or unreadable while listing
+        except OSError:
+            pass
+        return entry
+
+    @staticmethod
+    def _join(rel, name):
+        return name if rel == '.' else os.path.join(rel, name)
+
+    def path(self, rel, name=''):
+        return os.path.normpath(os.path.join(self.root, rel, name))
+
+    def files(self, suffix='', exclude=()):
+        """
+        Yield (path, size, mtime_ns) of every file whose name ends with suffix,
+        skipping directories under any relative path in exclude.
+        """
+        for rel in sorted(self.dirs):
+            if any(rel == e or rel.startswith(e + os.sep) for e in exclude):
+                continue
+            for name, (size, mtime_ns) in sorted(self.dirs[rel]['files'].items()):
+                if name.endswith(suffix):
+                    yield self.path(rel, name), size, mtime_ns
+
+    def titles(self):
+        """
+        Group files by title: one dict per .mp4 or .srt name with the path, size
+        and mtime of each of its TITLE_SUFFIXES files (None when missing) and
+        whether its folder has a poster.
+        """
+        titles = []
+        for rel in sorted(self.dirs):
+            files = self.dirs[rel]['files']
+            names = {name[:-len(suffix)] for name in files for suffix in ('.mp4', '.srt') if name.endswith(suffix)}
+            for name in sorted(names):
+                title = {"dir": self.path(rel), "name": name, "poster": POSTER_NAME in files}
+                for key, suffix in TITLE_SUFFIXES.items():
+                    stat = files.get(name + suffix)
+                    title[key] = {"path": self.path(rel, name + suffix), "size": stat[0], "mtime_ns": stat[1]} if stat else None
+                titles.append(title)
+        return titles
+
+def load_inventory(root, full=False):
+    """
+    Load the cached inventory of root, refresh it and write it back.
+    """
+    inventory = MediaInventory(root).load().refresh(full)
+    inventory.save()
+    return inventory
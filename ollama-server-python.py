@@ -1,46 +1,497 @@
-from flask import Flask, request, jsonify, Response
-from flask_cors import CORS
-import requests
+import os
+import re
 import json
+import time
+import asyncio
+import hashlib
+import logging
+from collections import OrderedDict
+import aiohttp
+from aiohttp import web
+from ollama_engine import OllamaEngine
+from cue_journal import CueJournal, JOURNAL_SUFFIX, source_hash
+from translate_multi_file_CN2VI_fix import (
+    parse_srt_blocks, cue_text_lines, build_batches, translate_batch_with_context, translate_text_with_context
+)
 
-app = Flask(__name__)
-CORS(app)
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
 OLLAMA_URL = "http://localhost:11434"
+HOST = "127.0.0.1"
+PORT = 5000
+MAX_UPSTREAM_CONNECTIONS = 16  # Pooled keep-alive connections to Ollama
+KEEPALIVE_TIMEOUT = 60  # Seconds an idle upstream connection stays open
+TIMEOUT = 1800  # Seconds per generation; a whole SRT in one prompt runs long
+MAX_REQUEST_BYTES = 32 * 1024 * 1024  # aiohttp's 1 MiB default is too small for a long SRT
+CACHE_MAX_ENTRIES = 256  # Finished replies kept for replay
+CACHE_TTL = 24 * 3600  # Seconds a finished reply is replayed instead of regenerated
+MODELS_TTL = 30  # Seconds the /api/tags model list is reused
+JOB_BATCH_SIZE = 8  # Cues per request in /jobs
+JOB_CONCURRENCY = 4  # Requests in flight per job
+MAX_JOBS = 32  # Jobs kept in memory; the least recently active stopped ones are dropped first
+JOBS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".editor_jobs")  # Job journals, for resuming after a restart
+JOB_RETENTION = 7 * 24 * 3600  # Seconds an untouched job journal is kept
 
-@app.route('/translate', methods=['POST'])
-def translate():
-    data = request.json
-    
-    response = requests.post(f"{OLLAMA_URL}/api/generate", json=data, stream=True)
-    
-    def generate():
-        full_response = ""
-        for line in response.iter_lines():
-            if line:
-                try:
-                    json_response = json.loads(line)
-                    if 'response' in json_response:
-                        full_response += json_response['response']
-                        yield json.dumps({"response": full_response}) + "\n"
-                except json.JSONDecodeError:
-                    print(f"Failed to decode JSON: {line}")
-        
-        yield json.dumps({"response": full_response, "done": True}) + "\n"
-
-    return Response(generate(), content_type='application/json')
-
-@app.route('/models', methods=['GET'])
-def get_models():
+# The proxy streams deltas: each record carries only the text generated since
+# the previous one ({"response": "..."}), then {"response": "", "done": true}.
+# Records are NDJSON, or Server-Sent Events ("data: {...}") when the client
+# sends Accept: text/event-stream. When the browser aborts, the upstream
+# request is closed, which makes Ollama stop generating.
+#
+# Finished replies are cached by normalized request body and replayed as one
+# record, so reopening an SRT after a reload does not regenerate it (send
+# Cache-Control: no-cache to force a fresh translation). Identical requests that
+# arrive while the first is still generating share its upstream stream.
+
+def encode_event(record, sse=False):
+    line = json.dumps(record, ensure_ascii=False)
+    return (f"data: {line}\n\n" if sse else f"{line}\n").encode('utf-8')
+
+async def open_stream(request):
+    sse = 'text/event-stream' in request.headers.get('Accept', '')
+    response = web.StreamResponse(headers={
+        'Content-Type': 'text/event-stream' if sse else 'application/x-ndjson',
+        'Cache-Control': 'no-cache',
+    })
+    await response.prepare(request)
+    return response, sse
+
+async def ollama_chunks(upstream):
+    """
+    Decode Ollama's NDJSON stream. Lines are split by hand: the final chunk carries
+    the whole token context and can be longer than aiohttp's readline limit.
+    """
+    buffer = b''
+    async for data in upstream.content.iter_any():
+        buffer += data
+        *lines, buffer = buffer.split(b'\n')
+        for line in lines:
+            if not line.strip():
+                continue
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError:
+                logging.warning(f"Failed to decode JSON: {line[:100]!r}")
+    if buffer.strip():
+        try:
+            yield json.loads(buffer)
+        except json.JSONDecodeError:
+            logging.warning(f"Failed to decode JSON: {buffer[:100]!r}")
+
+def cache_key(data):
+    """
+    Key a /translate body on what decides the reply: transport fields dropped,
+    line endings unified, keys sorted.
+    """
+    normalized = {key: value.replace('\r\n', '\n') if isinstance(value, str) else value
+                  for key, value in data.items() if key not in ('stream', 'keep_alive')}
+    return hashlib.sha256(json.dumps(normalized, sort_keys=True, ensure_ascii=False).encode('utf-8')).hexdigest()
+
+class ResponseCache:
+    """
+    Finished /translate replies by cache_key (and the /models list), dropped after
+    ttl seconds or, past max_entries, least recently used first.
+    """
+    def __init__(self, max_entries=CACHE_MAX_ENTRIES, ttl=CACHE_TTL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.entries = OrderedDict()  # key -> (expires, value)
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        entry = self.entries.get(key)
+        if entry is None or entry[0] < time.monotonic():
+            self.entries.pop(key, None)
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    def put(self, key, value):
+        self.entries[key] = (time.monotonic() + self.ttl, value)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+class Generation:
+    """
+    One upstream generation, shared by every client that sent the same body while
+    it runs. Each follower replays the deltas from the start. The upstream request
+    is cancelled once the last follower has gone.
+    """
+    def __init__(self, app, key, data):
+        self.app = app
+        self.key = key
+        self.deltas = []
+        self.error = None
+        self.done = False
+        self.followers = 0
+        self.started = asyncio.get_running_loop().create_future()  # None, or (status, error) if Ollama refused
+        self._changed = asyncio.Event()
+        self.task = asyncio.create_task(self.run(data))
+
+    def publish(self, delta=None, error=None, done=False):
+        if delta:
+            self.deltas.append(delta)
+        if error is not None:
+            self.error = error
+        self.done = self.done or done
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    async def run(self, data):
+        try:
+            async with self.app['upstream'].post(f"{OLLAMA_URL}/api/generate", json=data) as upstream:
+                if upstream.status != 200:
+                    self.started.set_result((upstream.status, await upstream.text()))
+                    return
+                self.started.set_result(None)
+                async for chunk in ollama_chunks(upstream):
+                    if 'error' in chunk:
+                        self.publish(error=chunk['error'])
+                        return
+                    self.publish(chunk.get('response'))
+                    if chunk.get('done'):
+                        self.app['cache'].put(self.key, ''.join(self.deltas))
+                        break
+        except asyncio.CancelledError:
+            # Leaving the upstream block unfinished closes the connection, so Ollama stops generating
+            logging.info("Every client disconnected, upstream generation cancelled")
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            if not self.started.done():
+                self.started.set_result((502, str(e)))
+            self.publish(error=f"Ollama stream failed: {e!r}")
+        finally:
+            if not self.started.done():
+                self.started.cancel()
+            self.publish(done=True)
+            self.release()
+
+    def release(self):
+        if self.app['in_flight'].get(self.key) is self:
+            del self.app['in_flight'][self.key]
+
+    async def follow(self):
+        i = 0
+        while True:
+            while i < len(self.deltas):
+                i += 1
+                yield self.deltas[i - 1]
+            if self.done:
+                return
+            await self._changed.wait()
+
+async def translate(request):
+    data = await request.json()
+    data['stream'] = True
+    key = cache_key(data)
+    if 'no-cache' not in request.headers.get('Cache-Control', ''):
+        cached = request.app['cache'].get(key)
+        if cached is not None:
+            response, sse = await open_stream(request)
+            await response.write(encode_event({"response": cached}, sse))
+            await response.write(encode_event({"response": "", "done": True, "cached": True}, sse))
+            await response.write_eof()
+            return response
+
+    generation = request.app['in_flight'].get(key)
+    if generation is None:
+        generation = request.app['in_flight'][key] = Generation(request.app, key, data)
+    generation.followers += 1
+    response = None
     try:
-        response = requests.get(f"{OLLAMA_URL}/api/tags")
-        if response.status_code == 200:
-            models = response.json().get('models', [])
-            return jsonify({"models": [model['name'] for model in models]})
+        refused = await asyncio.shield(generation.started)
+        if refused is not None:
+            status, error = refused
+            return web.json_response({"error": error}, status=status)
+        response, sse = await open_stream(request)
+        async for delta in generation.follow():
+            await response.write(encode_event({"response": delta}, sse))
+        if generation.error is not None:
+            await response.write(encode_event({"error": generation.error, "done": True}, sse))
         else:
-            return jsonify({"error": "Failed to fetch models from Ollama"}), 500
+            await response.write(encode_event({"response": "", "done": True}, sse))
+        await response.write_eof()
+        return response
+    except ConnectionResetError:
+        logging.info("Client disconnected")
+        return response if response is not None else web.Response()
+    finally:
+        generation.followers -= 1
+        if generation.followers == 0 and not generation.done:
+            generation.release()  # A client arriving now starts afresh instead of joining a cancelled generation
+            generation.task.cancel()
+
+async def get_models(request):
+    cached = request.app['models'].get('models')
+    if cached is not None:
+        return web.json_response(cached)
+    try:
+        async with request.app['upstream'].get(f"{OLLAMA_URL}/api/tags") as response:
+            if response.status == 200:
+                models = (await response.json()).get('models', [])
+                payload = {"models": [model['name'] for model in models]}
+                request.app['models'].put('models', payload)
+                return web.json_response(payload)
+            else:
+                return web.json_response({"error": "Failed to fetch models from Ollama"}, status=500)
     except Exception as e:
-        return jsonify({"error": str(e)}), 500
+        return web.json_response({"error": str(e)}, status=500)
+
+class TranslationJob:
+    """
+    One SRT translated cue by cue: consecutive cues go out in batches, at most
+    JOB_CONCURRENCY requests at a time, and each finished cue is journaled and
+    published as an event. The job id is derived from the SRT, model and
+    language, so posting the same file again resumes the same job, also after a
+    server restart, from its journal.
+    """
+    def __init__(self, app, job_id, srt, model, target_language):
+        self.app = app
+        self.job_id = job_id
+        self.model = model
+        self.target_language = target_language
+        blocks = [block for block in parse_srt_blocks(srt.splitlines()) if any('-->' in line for line in block)]
+        self.cues = [{"index": i,
+                      "number": block[0] if re.match(r'^\d+$', block[0]) else str(i + 1),
+                      "timestamp": next(line for line in block if '-->' in line),
+                      "source": '\n'.join(cue_text_lines(block))}
+                     for i, block in enumerate(blocks)]
+        self.cue_lines = [cue_text_lines(block) for block in blocks]
+        self.context_lines = [block[2:] for block in blocks]
+        self.events = []  # Finished cues in completion order; an event's id is its position
+        self.finished = {}  # cue index -> translated text
+        self.failed = set()
+        self.state = "pending"
+        self.error = None
+        self.task = None
+        self.updated = time.monotonic()
+        self._changed = asyncio.Event()
+        self.journal = CueJournal(os.path.join(JOBS_DIR, job_id + JOURNAL_SUFFIX), job_id)
+        for (_, i), text in sorted(self.journal.load().items(), key=lambda item: item[0][1]):
+            self.publish(i, text, record=False)
+        if len(self.finished) == len(self.cues):
+            self.state = "done"  # Every cue came back from the journal; nothing left to start
+
+    def publish(self, i, text, failed=False, record=True):
+        if failed:
+            self.failed.add(i)
+        else:
+            self.failed.discard(i)
+            self.finished[i] = text
+            if record:
+                self.journal.record(self.target_language, i, text)
+        self.events.append({"index": i, "text": text, "failed": failed})
+        self.notify()
+
+    def notify(self):
+        self.updated = time.monotonic()
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    def start(self):
+        if self.task is not None and not self.task.done():
+            return
+        self.failed.clear()
+        self.error = None
+        self.state = "running"
+        self.task = asyncio.create_task(self.run())
+
+    def cancel(self):
+        if self.task is not None and not self.task.done():
+            self.task.cancel()
+
+    async def run(self):
+        engine = self.app['engine']
+        limiter = asyncio.Semaphore(JOB_CONCURRENCY)
+        last = len(self.cues) - 1
+
+        async def single(i):
+            prev_lines = self.context_lines[i-1] if i > 0 else []
+            next_lines = self.context_lines[i+1] if i < last else []
+            lines = await translate_text_with_context(engine, self.cue_lines[i], prev_lines, next_lines,
+                                                      self.target_language, limiter, model=self.model)
+            if lines is None:
+                self.publish(i, self.cues[i]["source"], failed=True)
+            else:
+                self.publish(i, '\n'.join(lines))
+
+        async def batched(batch):
+            prev_lines = self.context_lines[batch[0]-1] if batch[0] > 0 else []
+            next_lines = self.context_lines[batch[-1]+1] if batch[-1] < last else []
+            results = await translate_batch_with_context(engine, batch, self.cue_lines, prev_lines, next_lines,
+                                                         self.target_language, limiter, self.model)
+            for i in batch:
+                if i in results:
+                    self.publish(i, '\n'.join(results[i]))
+            # Cues missing from the numbered reply are sent on their own
+            await asyncio.gather(*(single(i) for i in batch if i not in results))
+
+        pending = [i for i, lines in enumerate(self.cue_lines) if lines and i not in self.finished]
+        for i, lines in enumerate(self.cue_lines):
+            if not lines and i not in self.finished:
+                self.publish(i, '')
+        tasks = [asyncio.create_task(batched(batch)) for batch in build_batches(pending, self.cue_lines, JOB_BATCH_SIZE)]
+        try:
+            await asyncio.gather(*tasks)
+            self.state = "done"
+        except asyncio.CancelledError:
+            self.state = "cancelled"
+        except Exception as e:
+            # E.g. a locked translation memory: stop the other batches, keep the journal and let the page resume
+            logging.exception(f"Job {self.job_id} failed")
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            self.error = f"{type(e).__name__}: {e}"
+            self.state = "failed"
+        finally:
+            self.journal.sync()
+            self.notify()
+
+    def status(self):
+        status = {"job_id": self.job_id, "state": self.state, "total": len(self.cues),
+                  "translated": len(self.finished), "failed": len(self.failed)}
+        if self.error is not None:
+            status["error"] = self.error
+        return status
+
+    async def follow(self, after=-1):
+        """
+        Yield (event id, event) from after + 1 on, waiting for new cues until the job stops.
+        """
+        n = after + 1
+        while True:
+            while n < len(self.events):
+                n += 1
+                yield n - 1, self.events[n - 1]
+            if self.state != "running":
+                return
+            await self._changed.wait()
+
+def encode_sse(record, event, event_id=None):
+    lines = f"id: {event_id}\n" if event_id is not None else ""
+    return f"{lines}event: {event}\ndata: {json.dumps(record, ensure_ascii=False)}\n\n".encode('utf-8')
+
+def get_job(request):
+    job = request.app['jobs'].get(request.match_info['job_id'])
+    if job is None:
+        raise web.HTTPNotFound(text=json.dumps({"error": "Unknown job"}), content_type='application/json')
+    return job
+
+def evict_jobs(jobs):
+    # Forget the least recently active stopped jobs; their journals stay on disk for a later resume
+    stopped = sorted((job for job in jobs.values() if job.state != "running"), key=lambda job: job.updated)
+    for job in stopped[:max(len(jobs) - MAX_JOBS, 0)]:
+        job.journal.close()
+        del jobs[job.job_id]
+
+async def create_job(request):
+    data = await request.json()
+    srt, model = data.get('srt', ''), data.get('model')
+    target_language = data.get('target_language', 'Vietnamese')
+    if not srt.strip() or not model:
+        return web.json_response({"error": "srt and model are required"}, status=400)
+    srt = srt.replace('\r\n', '\n')
+    job_id = source_hash(f"{model}\n{target_language}\n{srt}")[:16]
+    jobs = request.app['jobs']
+    job = jobs.get(job_id)
+    if job is None:
+        job = jobs[job_id] = TranslationJob(request.app, job_id, srt, model, target_language)
+        evict_jobs(jobs)
+    if len(job.finished) < len(job.cues):
+        job.start()  # New, or a cancelled/interrupted job picking up where it stopped
+    return web.json_response({**job.status(), "cues": job.cues})
+
+async def job_status(request):
+    return web.json_response(get_job(request).status())
+
+async def resume_job(request):
+    job = get_job(request)
+    if len(job.finished) < len(job.cues):
+        job.start()
+    return web.json_response(job.status())
+
+async def cancel_job(request):
+    job = get_job(request)
+    job.cancel()
+    return web.json_response({**job.status(), "state": "cancelled" if job.state == "running" else job.state})
+
+async def job_events(request):
+    """
+    SSE stream of a job's cues ("cue" events, each with the cue index and text)
+    ending with a "done" event carrying the job status. Finished cues are
+    replayed first; a client reconnecting with Last-Event-ID (or ?after=) only
+    gets the cues it has not seen.
+    """
+    job = get_job(request)
+    after = int(request.headers.get('Last-Event-ID', request.query.get('after', -1)))
+    response = web.StreamResponse(headers={'Content-Type': 'text/event-stream', 'Cache-Control': 'no-cache'})
+    await response.prepare(request)
+    try:
+        async for event_id, event in job.follow(after):
+            await response.write(encode_sse(event, "cue", event_id))
+        await response.write(encode_sse(job.status(), "done"))
+        await response.write_eof()
+    except ConnectionResetError:
+        pass  # The job keeps running; the page can reconnect or cancel it
+    return response
+
+async def ollama_engine(app):
+    prune_job_journals()
+    async with OllamaEngine(hosts=[OLLAMA_URL]) as engine:
+        app['engine'] = engine
+        yield
+        for job in app['jobs'].values():
+            job.cancel()
+        await asyncio.gather(*(job.task for job in app['jobs'].values() if job.task is not None), return_exceptions=True)
+        for job in app['jobs'].values():
+            job.journal.close()
+
+def prune_job_journals():
+    os.makedirs(JOBS_DIR, exist_ok=True)
+    for entry in os.scandir(JOBS_DIR):
+        if entry.name.endswith(JOURNAL_SUFFIX) and time.time() - entry.stat().st_mtime > JOB_RETENTION:
+            os.remove(entry.path)
+
+@web.middleware
+async def preflight(request, handler):
+    if request.method == 'OPTIONS':
+        return web.Response()
+    return await handler(request)
+
+async def add_cors_headers(request, response):
+    # A signal rather than a middleware: streamed responses send their headers before the handler returns
+    response.headers['Access-Control-Allow-Origin'] = '*'
+    response.headers['Access-Control-Allow-Methods'] = 'GET, POST, DELETE, OPTIONS'
+    response.headers['Access-Control-Allow-Headers'] = 'Content-Type'
+
+async def upstream_session(app):
+    connector = aiohttp.TCPConnector(limit=MAX_UPSTREAM_CONNECTIONS, keepalive_timeout=KEEPALIVE_TIMEOUT)
+    app['upstream'] = aiohttp.ClientSession(connector=connector, timeout=aiohttp.ClientTimeout(total=TIMEOUT))
+    yield
+    await app['upstream'].close()
+
+def create_app():
+    app = web.Application(middlewares=[preflight], client_max_size=MAX_REQUEST_BYTES)
+    app['cache'] = ResponseCache()
+    app['in_flight'] = {}  # cache_key -> running Generation
+    app['models'] = ResponseCache(max_entries=1, ttl=MODELS_TTL)
+    app['jobs'] = {}  # job id -> TranslationJob
+    app.cleanup_ctx.append(upstream_session)
+    app.cleanup_ctx.append(ollama_engine)
+    app.on_response_prepare.append(add_cors_headers)
+    app.router.add_post('/translate', translate)
+    app.router.add_get('/models', get_models)
+    app.router.add_post('/jobs', create_job)
+    app.router.add_get('/jobs/{job_id}', job_status)
+    app.router.add_get('/jobs/{job_id}/events', job_events)
+    app.router.add_post('/jobs/{job_id}/resume', resume_job)
+    app.router.add_delete('/jobs/{job_id}', cancel_job)
+    return app
 
 if __name__ == '__main__':
-    app.run(debug=True, port=5000)
\ No newline at end of file
+    # handler_cancellation: a browser abort cancels the handler even while it waits on Ollama
+    web.run_app(create_app(), host=HOST, port=PORT, handler_cancellation=True)
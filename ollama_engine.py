@@ -0,0 +1,130 @@
+import time
+import asyncio
+import logging
+import aiohttp
+from adaptive_limiter import AdaptiveLimiter
+from ollama_pool import EndpointPool, NoEndpointAvailable, OLLAMA_HOSTS
+from ollama_stream import read_stream, uncapped, unusable
+from ollama_metrics import metrics
+from stage_profile import profiler
+MAX_RETRIES = 3
+TIMEOUT = 300  # Seconds per generation; large models on long prompts are slow
+MAX_IN_FLIGHT = 16  # Ceiling on concurrent generations per Ollama host
+ADAPTIVE_CONCURRENCY = True  # Let AdaptiveLimiter find the throughput knee below MAX_IN_FLIGHT
+KEEPALIVE_TIMEOUT = 60  # Seconds an idle pooled connection stays open
+KEEP_ALIVE = "30m"  # How long Ollama keeps the model (and its cached prompt prefix) loaded between requests
+
+class OllamaEngine:
+    """
+    Shared aiohttp client for /api/generate: one keep-alive connection pool and a
+    cap on in-flight requests per host, adjusted by an AdaptiveLimiter unless
+    adaptive is False. Requests are spread over the hosts of an EndpointPool.
+    Callers can pass their own semaphore to generate() to bound in-flight
+    requests per file as well.
+    """
+    def __init__(self, hosts=OLLAMA_HOSTS, max_in_flight=MAX_IN_FLIGHT, timeout=TIMEOUT, max_retries=MAX_RETRIES,
+                 adaptive=ADAPTIVE_CONCURRENCY):
+        self.max_in_flight = max_in_flight
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.adaptive = adaptive
+        self.pool = EndpointPool(hosts, limiter_factory=self._make_limiter)
+        self.session = None
+        self.requests = 0
+        self.prompt_eval_count = 0
+        self.eval_count = 0
+        self.model_seconds = {}  # model -> seconds of generation (Ollama's total_duration, else wall time)
+
+    def _make_limiter(self):
+        if self.adaptive:
+            return AdaptiveLimiter(max_limit=self.max_in_flight)
+        return AdaptiveLimiter(self.max_in_flight, self.max_in_flight, self.max_in_flight)
+
+    async def __aenter__(self):
+        connector = aiohttp.TCPConnector(limit=self.max_in_flight * len(self.pool.endpoints),
+                                         limit_per_host=self.max_in_flight, keepalive_timeout=KEEPALIVE_TIMEOUT)
+        self.session = aiohttp.ClientSession(connector=connector, timeout=aiohttp.ClientTimeout(total=self.timeout))
+        await self.pool.start(self.session)
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.pool.stop()
+        await self.session.close()
+        self.pool.log_summary()
+        logging.info(self.summary())
+
+    def summary(self):
+        per_request = self.prompt_eval_count / self.requests if self.requests else 0.0
+        return (f"{self.requests} generations, {self.prompt_eval_count} prompt tokens evaluated "
+                f"({per_request:.1f} per request), {self.eval_count} tokens generated")
+
+    async def generate(self, payload, limiter=None, expected_lines=None, line_pattern=None):
+        """
+        POST one generation and return the decoded response, or None after MAX_RETRIES.
+        A payload with "stream": True is read as it arrives and, with expected_lines,
+        cut off once that many lines are complete (see ollama_stream.py). A reply cut
+        off by num_predict, or with no translated line, is retried without the cap;
+        if it is unusable even then, None is returned so it is never used.
+        """
+        tried = set()
+        model = payload.get('model')
+        for attempt in range(self.max_retries + 1):
+            queued = time.monotonic()
+            try:
+                if limiter is not None:
+                    async with limiter:
+                        result = await self._post(payload, tried, queued, expected_lines, line_pattern)
+                else:
+                    result = await self._post(payload, tried, queued, expected_lines, line_pattern)
+                if result is not None and unusable(result):
+                    reason = "hit the length limit" if result.get('capped') else "had no translated line"
+                    if 'num_predict' not in payload.get('options', {}):
+                        logging.error(f"Ollama reply for {model} {reason}, dropping it")
+                        metrics.observe_retries(model, attempt, failed=True)
+                        return None
+                    logging.warning(f"Ollama reply for {model} {reason}, retrying without the cap")
+                    payload = uncapped(payload)
+                    continue
+                metrics.observe_retries(model, attempt)
+                return result
+            except (aiohttp.ClientError, asyncio.TimeoutError, NoEndpointAvailable) as e:
+                if isinstance(e, asyncio.TimeoutError):
+                    metrics.observe_timeout(model)
+                if attempt == self.max_retries:
+                    logging.error(f"Ollama request failed after {self.max_retries} retries: {e!r}")
+                    metrics.observe_retries(model, attempt, failed=True)
+                    return None
+                if self.pool.select(payload.get('model'), tried) is None:
+                    # Every host has failed this request: back off, then try them all again
+                    tried.clear()
+                    await asyncio.sleep(2 ** attempt)  # Exponential backoff
+        metrics.observe_retries(model, self.max_retries, failed=True)
+        return None
+
+    async def _post(self, payload, tried, queued, expected_lines=None, line_pattern=None):
+        async with self.pool.route(payload.get('model'), tried) as endpoint, endpoint.limiter.slot() as sample:
+            started = time.monotonic()
+            async with self.session.post(endpoint.generate_url, json={"keep_alive": KEEP_ALIVE, **payload}) as response:
+                if response.status >= 500:
+                    raise aiohttp.ClientResponseError(
+                        response.request_info, response.history, status=response.status, message=await response.text())
+                if response.status != 200:
+                    logging.error(f"Ollama returned {response.status}: {await response.text()}")
+                    return None
+                if payload.get('stream'):
+                    num_predict = payload.get('options', {}).get('num_predict')
+                    result = await read_stream(response, expected_lines, line_pattern, num_predict)
+                else:
+                    result = await response.json(content_type=None)
+                if not result.get('aborted'):
+                    sample["result"] = result  # A stream cut short has no timing for the limiter to learn from
+                self.requests += 1
+                self.prompt_eval_count += result.get('prompt_eval_count', 0)
+                self.eval_count += result.get('eval_count', 0)
+                elapsed = time.monotonic() - started
+                seconds = result.get('total_duration', 0) / 1e9 or elapsed
+                model = payload.get('model')
+                self.model_seconds[model] = self.model_seconds.get(model, 0.0) + seconds
+                metrics.observe_generation(model, result, elapsed, started - queued)
+                profiler.request(started - queued, elapsed, result)
+                return result
@@ -0,0 +1,203 @@
+import os
+import json
+import time
+import bisect
+import logging
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Per-request metrics from the timing fields Ollama returns with every generation
+# (eval_count/eval_duration, prompt_eval_*, load_duration, total_duration) plus
+# the client side: time waiting for a slot, retries, timeouts. The Ollama scripts
+# feed the shared `metrics` registry; it is served in Prometheus text format on
+# http://127.0.0.1:METRICS_PORT/metrics while a run is going and written out as a
+# JSON summary at the end.
+METRICS_PORT = int(os.environ.get("TRANSLATE_METRICS_PORT", "9464"))  # 0 disables the endpoint
+METRICS_SUMMARY_NAME = "translation_metrics.json"
+
+RATE_BUCKETS = (1, 2, 5, 10, 15, 20, 30, 50, 75, 100, 200, 500, 1000)  # tokens/s
+SECONDS_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2, 5, 10, 30, 60, 120, 300)
+RETRY_BUCKETS = (0, 1, 2, 3, 5)
+
+class Histogram:
+    def __init__(self, name, help_text, buckets):
+        self.name = name
+        self.help = help_text
+        self.buckets = tuple(buckets)
+        self.series = {}  # labels tuple -> [bucket counts..., +Inf count, sum]
+
+    def observe(self, value, **labels):
+        key = tuple(sorted(labels.items()))
+        state = self.series.setdefault(key, [0] * (len(self.buckets) + 2))
+        state[bisect.bisect_left(self.buckets, value)] += 1
+        state[-1] += value
+
+    def quantile(self, state, q):
+        # Upper bound of the bucket holding the q-th observation
+        count = sum(state[:-1])
+        seen = 0
+        for bound, n in zip(self.buckets + ('+Inf',), state[:-1]):
+            seen += n
+            if seen >= q * count:
+                return bound
+        return '+Inf'
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for key, state in sorted(self.series.items()):
+            cumulative = 0
+            for bound, n in zip(self.buckets + ('+Inf',), state[:-1]):
+                cumulative += n
+                lines.append(f"{self.name}_bucket{format_labels(key + (('le', bound),))} {cumulative}")
+            lines.append(f"{self.name}_sum{format_labels(key)} {state[-1]}")
+            lines.append(f"{self.name}_count{format_labels(key)} {cumulative}")
+        return lines
+
+    def summary(self):
+        summary = {}
+        for key, state in sorted(self.series.items()):
+            count = sum(state[:-1])
+            summary[','.join(f"{k}={v}" for k, v in key) or 'all'] = {
+                "count": count,
+                "mean": round(state[-1] / count, 3) if count else 0.0,
+                "p50": self.quantile(state, 0.5),
+                "p90": self.quantile(state, 0.9),
+                "p99": self.quantile(state, 0.99),
+            }
+        return summary
+
+class Counter:
+    def __init__(self, name, help_text):
+        self.name = name
+        self.help = help_text
+        self.series = {}
+
+    def inc(self, amount=1, **labels):
+        key = tuple(sorted(labels.items()))
+        self.series[key] = self.series.get(key, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        lines += [f"{self.name}{format_labels(key)} {value}" for key, value in sorted(self.series.items())]
+        return lines
+
+    def summary(self):
+        return {','.join(f"{k}={v}" for k, v in key) or 'all': value for key, value in sorted(self.series.items())}
+
+def format_labels(key):
+    if not key:
+        return ''
+    return '{' + ','.join(f'{k}="{v}"' for k, v in key) + '}'
+
+class MetricsRegistry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.started = time.time()
+        self.eval_rate = Histogram("ollama_eval_tokens_per_second", "Generation speed per request", RATE_BUCKETS)
+        self.prompt_rate = Histogram("ollama_prompt_tokens_per_second", "Prompt evaluation speed per request", RATE_BUCKETS)
+        self.queue_wait = Histogram("ollama_queue_wait_seconds", "Time a request waited for a client slot and inside Ollama before running", SECONDS_BUCKETS)
+        self.load_time = Histogram("ollama_load_seconds", "Model load time reported per request", SECONDS_BUCKETS)
+        self.latency = Histogram("ollama_request_seconds", "Wall time per request", SECONDS_BUCKETS)
+        self.retries = Histogram("ollama_request_retries", "Retries needed per request", RETRY_BUCKETS)
+        self.requests = Counter("ollama_requests_total", "Completed generations")
+        self.prompt_tokens = Counter("ollama_prompt_tokens_total", "Prompt tokens evaluated")
+        self.eval_tokens = Counter("ollama_eval_tokens_total", "Tokens generated")
+        self.timeouts = Counter("ollama_timeouts_total", "Requests that timed out")
+        self.failures = Counter("ollama_failed_requests_total", "Requests abandoned after all retries")
+        self._server = None
+
+    def observe_generation(self, model, result, elapsed, slot_wait=0.0):
+        """
+        Record one finished generation: result is Ollama's decoded response, elapsed
+        the wall time of the HTTP request and slot_wait the time spent before it
+        could be sent.
+        """
+        with self._lock:
+            self.requests.inc(model=model)
+            self.latency.observe(elapsed, model=model)
+            eval_count = result.get('eval_count', 0)
+            prompt_eval_count = result.get('prompt_eval_count', 0)
+            self.eval_tokens.inc(eval_count, model=model)
+            self.prompt_tokens.inc(prompt_eval_count, model=model)
+            if eval_count and result.get('eval_duration'):
+                self.eval_rate.observe(eval_count / (result['eval_duration'] / 1e9), model=model)
+            if prompt_eval_count and result.get('prompt_eval_duration'):
+                self.prompt_rate.observe(prompt_eval_count / (result['prompt_eval_duration'] / 1e9), model=model)
+            if result.get('load_duration'):
+                self.load_time.observe(result['load_duration'] / 1e9, model=model)
+            server_queue = elapsed - result['total_duration'] / 1e9 if result.get('total_duration') else 0.0
+            self.queue_wait.observe(slot_wait + max(server_queue, 0.0), model=model)
+
+    def observe_retries(self, model, retries, failed=False):
+        with self._lock:
+            self.retries.observe(retries, model=model)
+            if failed:
+                self.failures.inc(model=model)
+
+    def observe_timeout(self, model):
+        with self._lock:
+            self.timeouts.inc(model=model)
+
+    def metrics(self):
+        return [self.eval_rate, self.prompt_rate, self.queue_wait, self.load_time, self.latency, self.retries,
+                self.requests, self.prompt_tokens, self.eval_tokens, self.timeouts, self.failures]
+
+    def render(self):
+        with self._lock:
+            return '\n'.join(line for metric in self.metrics() for line in metric.render()) + '\n'
+
+    def summary(self):
+        with self._lock:
+            summary = {"started": self.started, "elapsed_seconds": round(time.time() - self.started, 1)}
+            summary.update({metric.name: metric.summary() for metric in self.metrics()})
+            return summary
+
+    def write_summary(self, path):
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(self.summary(), f, indent=2)
+        logging.info(f"Metrics summary written to {path}")
+
+    def serve(self, port=METRICS_PORT):
+        """
+        Serve /metrics on 127.0.0.1:port from a background thread. A port that is
+        taken (e.g. by another run) only costs the endpoint, not the run.
+        """
+        if not port or self._server is not None:
+            return
+        registry = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?')[0] == '/metrics':
+                    body = registry.render().encode('utf-8')
+                    content_type = 'text/plain; version=0.0.4'
+                elif self.path.split('?')[0] == '/summary':
+                    body = json.dumps(registry.summary()).encode('utf-8')
+                    content_type = 'application/json'
+                else:
+                    self.send_error(404)
+                    return
+                self.send_response(200)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        try:
+            self._server = ThreadingHTTPServer(('127.0.0.1', port), Handler)
+        except OSError as e:
+            logging.warning(f"Metrics endpoint not started on port {port}: {e}")
+            return
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        logging.info(f"Metrics at http://127.0.0.1:{port}/metrics")
+
+    def shutdown(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+metrics = MetricsRegistry()
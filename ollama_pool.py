@@ -0,0 +1,144 @@
+import os
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+import aiohttp
+
+# Pool of Ollama hosts. Set OLLAMA_HOSTS to a comma-separated list of base URLs
+# (e.g. "http://gpu1:11434,http://gpu2:11434") to spread requests over several
+# machines; by default only the local server is used.
+OLLAMA_HOSTS = [host.strip().rstrip('/') for host in os.environ.get("OLLAMA_HOSTS", "http://localhost:11434").split(',') if host.strip()]
+HEALTH_CHECK_INTERVAL = 30  # Seconds between /api/tags checks of every host
+HEALTH_CHECK_TIMEOUT = 5
+
+class NoEndpointAvailable(ConnectionError):
+    pass
+
+def normalize_model(name):
+    return name if ':' in name else f"{name}:latest"
+
+class Endpoint:
+    def __init__(self, base_url, limiter=None):
+        self.base_url = base_url
+        self.limiter = limiter
+        self.generate_url = f"{base_url}/api/generate"
+        self.healthy = True  # Optimistic until the first check says otherwise
+        self.models = None  # None until /api/tags has answered once
+        self.outstanding = 0
+        self.requests = 0
+        self.failures = 0
+
+    def load(self):
+        # Outstanding requests relative to what this host is currently allowed
+        return self.outstanding / self.limiter.limit if self.limiter is not None else self.outstanding
+
+    def serves(self, model):
+        return self.models is None or model is None or normalize_model(model) in self.models
+
+    def __repr__(self):
+        return f"Endpoint({self.base_url})"
+
+class EndpointPool:
+    """
+    Routes each request to the healthy host with the fewest outstanding requests
+    among those that have the requested model. Hosts are checked through
+    /api/tags every check_interval seconds; a host that fails a request is taken
+    out of rotation until its next successful check. limiter_factory, if given,
+    builds a concurrency limiter (e.g. AdaptiveLimiter) per host, since hosts
+    with different GPUs settle at different limits.
+    """
+    def __init__(self, hosts=OLLAMA_HOSTS, check_interval=HEALTH_CHECK_INTERVAL, limiter_factory=None):
+        self.endpoints = [Endpoint(host, limiter_factory() if limiter_factory else None) for host in hosts]
+        self.check_interval = check_interval
+        self._session = None
+        self._task = None
+
+    async def start(self, session):
+        self._session = session
+        await self.check_all()
+        self._task = asyncio.create_task(self._check_loop())
+        return self
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def check(self, endpoint):
+        try:
+            timeout = aiohttp.ClientTimeout(total=HEALTH_CHECK_TIMEOUT)
+            async with self._session.get(f"{endpoint.base_url}/api/tags", timeout=timeout) as response:
+                response.raise_for_status()
+                result = await response.json(content_type=None)
+            endpoint.models = {normalize_model(model['name']) for model in result.get('models', [])}
+            if not endpoint.healthy:
+                logging.info(f"Ollama host {endpoint.base_url} is back")
+            endpoint.healthy = True
+        except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:
+            if endpoint.healthy:
+                logging.warning(f"Ollama host {endpoint.base_url} failed its health check: {e!r}")
+            endpoint.healthy = False
+
+    async def check_all(self):
+        await asyncio.gather(*(self.check(endpoint) for endpoint in self.endpoints))
+
+    async def _check_loop(self):
+        while True:
+            await asyncio.sleep(self.check_interval)
+            await self.check_all()
+
+    def select(self, model, exclude=()):
+        candidates = [e for e in self.endpoints if e.serves(model) and e not in exclude]
+        # Unhealthy hosts are only a last resort, so a single-host setup still
+        # retries through a transient failure
+        healthy = [e for e in candidates if e.healthy]
+        candidates = healthy or candidates
+        if not candidates:
+            return None
+        return min(candidates, key=lambda e: (e.load(), e.requests))
+
+    def mark_failed(self, endpoint):
+        endpoint.failures += 1
+        if endpoint.healthy and len(self.endpoints) > 1:
+            logging.warning(f"Ollama host {endpoint.base_url} failed a request, routing around it")
+        endpoint.healthy = False
+
+    @asynccontextmanager
+    async def route(self, model, exclude=()):
+        """
+        Hold an outstanding-request slot on the best host for model. A failing
+        request marks the host and is added to exclude so the caller's retry goes
+        elsewhere.
+        """
+        endpoint = self.select(model, exclude)
+        if endpoint is None:
+            raise NoEndpointAvailable(f"No Ollama host available for model {model}")
+        endpoint.outstanding += 1
+        endpoint.requests += 1
+        try:
+            yield endpoint
+        except (aiohttp.ClientError, asyncio.TimeoutError, OSError):
+            self.mark_failed(endpoint)
+            if isinstance(exclude, set):
+                exclude.add(endpoint)
+            raise
+        finally:
+            endpoint.outstanding -= 1
+
+    def summary(self):
+        summary = {}
+        for e in self.endpoints:
+            summary[e.base_url] = {"requests": e.requests, "failures": e.failures, "healthy": e.healthy}
+            if e.limiter is not None:
+                summary[e.base_url]["limit"] = round(e.limiter.limit, 1)
+                summary[e.base_url]["congestion_events"] = e.limiter.congestion_events
+        return summary
+
+    def log_summary(self):
+        for host, stats in self.summary().items():
+            limit = f", concurrency settled at {stats['limit']}" if 'limit' in stats else ""
+            logging.info(f"{host}: {stats['requests']} requests, {stats['failures']} failures{limit}")
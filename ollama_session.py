@@ -0,0 +1,116 @@
+import json
+import requests
+from translation_memory import get_translation_memory
+
+OLLAMA_URL = "http://localhost:11434/api/generate"
+SESSION_WINDOW = 32  # Requests chained on one KV context before starting over
+SESSION_PROMPT_TEMPLATE = """Translate the Chinese movie subtitles I send you to {target_language}, one subtitle per message.
+
+    Instructions:
+    1. Understand the natural meaning and nuance of the Chinese text in the context of the movie.
+    2. Express this meaning naturally in {target_language}, as if originally written in {target_language}.
+    3. Keep the original phrase.
+    4. Do not include any introductions, explanations, warning or comments.
+    5. Ensure the translation captures the meaning accurately, rather than translating word-for-word.
+    6. Directly translate the slurs or insults words. Use same pronunciation in Chinese of character name and noun..
+    7. Maintain the style appropriate for movie subtitles (concise yet clear).
+    8. Reply with only the translation of the latest subtitle, preserving the line structure."""
+
+class OllamaSession:
+    """
+    Chain /api/generate calls through the `context` array Ollama returns, so each
+    request only prompt-evaluates the new text instead of the instructions and
+    neighbouring lines again. The chain restarts every `window` requests to keep
+    the context (and server memory) bounded.
+    """
+    def __init__(self, model, instructions, window=SESSION_WINDOW, url=OLLAMA_URL):
+        self.model = model
+        self.instructions = instructions
+        self.window = window
+        self.url = url
+        self.context = None
+        self.turns = 0
+        self.requests = 0
+        self.prompt_eval_count = 0
+        self.eval_count = 0
+
+    def reset(self):
+        self.context = None
+        self.turns = 0
+
+    def build_payload(self, text):
+        if self.context is None or self.turns >= self.window:
+            self.reset()
+            prompt = f"{self.instructions}\n\n{text}"
+        else:
+            prompt = text
+
+        data = {
+            "model": self.model,
+            "prompt": prompt,
+            "stream": False
+        }
+        if self.context is not None:
+            data["context"] = self.context
+        return data
+
+    def record(self, result):
+        if result is None:
+            self.reset()
+            return None
+        self.context = result.get('context')
+        self.turns += 1
+        self.requests += 1
+        self.prompt_eval_count += result.get('prompt_eval_count', 0)
+        self.eval_count += result.get('eval_count', 0)
+        return result.get('response', '')
+
+    def generate(self, text):
+        response = requests.post(self.url, json=self.build_payload(text))
+        if response.status_code != 200:
+            print(f"Error: {response.status_code}")
+            return self.record(None)
+        try:
+            result = response.json()
+        except json.JSONDecodeError:
+            print(f"Error decoding JSON: {response.text}")
+            result = None
+        return self.record(result)
+
+    async def agenerate(self, engine, text):
+        """
+        Same as generate(), but through an OllamaEngine. Cues of one session must be
+        awaited one after another since each request needs the previous context.
+        """
+        return self.record(await engine.generate(self.build_payload(text)))
+
+def _session_lines(session, text_lines, target_language, translation):
+    if translation is None:
+        return None
+    translated_lines = translation.strip().split('\n')
+    while len(translated_lines) < len(text_lines):
+        translated_lines.append('')
+    translated_lines = translated_lines[:len(text_lines)]
+    get_translation_memory().put('\n'.join(text_lines), target_language, session.model, SESSION_PROMPT_TEMPLATE,
+                                 '\n'.join(translated_lines))
+    return translated_lines
+
+def _cached_lines(session, text_lines, target_language):
+    cached = get_translation_memory().get('\n'.join(text_lines), target_language, session.model, SESSION_PROMPT_TEMPLATE)
+    return cached.split('\n') if cached is not None else None
+
+def translate_text_in_session(session, text_lines, target_language="Vietnamese"):
+    """
+    Translate one cue on a session built from SESSION_PROMPT_TEMPLATE, going through
+    the translation memory first.
+    """
+    cached = _cached_lines(session, text_lines, target_language)
+    if cached is not None:
+        return cached
+    return _session_lines(session, text_lines, target_language, session.generate('\n'.join(text_lines)))
+
+async def atranslate_text_in_session(engine, session, text_lines, target_language="Vietnamese"):
+    cached = _cached_lines(session, text_lines, target_language)
+    if cached is not None:
+        return cached
+    return _session_lines(session, text_lines, target_language, await session.agenerate(engine, '\n'.join(text_lines)))
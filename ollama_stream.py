@@ -0,0 +1,121 @@
+import re
+import json
+import aiohttp
+from token_estimate import estimate_tokens
+
+# Streamed /api/generate. Subtitle translations are short and their length is known
+# up front: a reply gets a num_predict budget scaled from the source, stop
+# sequences that end it at the first blank line, and the stream is cut as soon as
+# the expected number of lines has arrived instead of waiting for the model to
+# finish an explanation nobody reads. A reply that runs into the budget is cut
+# off mid-translation: it comes back flagged "capped" and must be retried without
+# the cap (see uncapped()) rather than used or cached. So must a reply with no
+# translated line at all, only an introduction ("malformed", see unusable()).
+STOP_SEQUENCES = ["\n\n"]
+# An introduction the model puts before the translation instead of a translated line
+PREAMBLE_RE = re.compile(
+    r"^\s*(?:here(?: is|'s| are)|(?:the )?translation|dưới đây là|đây là|bản dịch)\b.*[:：]\s*$", re.IGNORECASE)
+NUM_PREDICT_RATIO = 4  # Output tokens allowed per estimated source token
+NUM_PREDICT_PER_LINE = 8  # ... plus this much per expected line (numbering, separators)
+NUM_PREDICT_MIN = 32
+
+def num_predict_for(text, lines=1):
+    return max(NUM_PREDICT_MIN, estimate_tokens(text) * NUM_PREDICT_RATIO + NUM_PREDICT_PER_LINE * lines)
+
+def stream_options(text, lines=1, stop=STOP_SEQUENCES):
+    """
+    Payload fields for a streamed request translating text into `lines` lines.
+    """
+    options = {"num_predict": num_predict_for(text, lines)}
+    if stop:
+        options["stop"] = list(stop)
+    return {"stream": True, "options": options}
+
+def uncapped(payload):
+    """
+    Copy of payload without its num_predict budget, for retrying a capped reply.
+    """
+    options = {key: value for key, value in payload.get('options', {}).items() if key != 'num_predict'}
+    return {**payload, "options": options}
+
+class StreamStats:
+    def __init__(self):
+        self.streams = 0
+        self.stopped_early = 0  # Cut by us once every expected line was in
+        self.capped = 0  # Ended by num_predict
+        self.tokens_streamed = 0
+        self.tokens_saved = 0  # Budget left unused by early stops (an upper bound)
+
+    def summary(self):
+        return (f"{self.streams} streamed generations, {self.stopped_early} stopped early, "
+                f"{self.capped} hit num_predict, {self.tokens_streamed} tokens streamed, "
+                f"up to {self.tokens_saved} tokens saved")
+
+stream_stats = StreamStats()
+
+def unusable(result):
+    return bool(result.get('capped') or result.get('malformed'))
+
+def reply_lines(text, line_pattern=None):
+    """
+    The translated lines of text: non-empty, matching line_pattern if given, and
+    not an introduction.
+    """
+    lines = [line for line in text.split('\n') if line.strip() and not PREAMBLE_RE.match(line)]
+    if line_pattern is not None:
+        lines = [line for line in lines if line_pattern.match(line)]
+    return lines
+
+def complete_lines(text, line_pattern=None):
+    return reply_lines(text[:text.rfind('\n') + 1], line_pattern)
+
+async def read_stream(response, expected_lines=None, line_pattern=None, num_predict=None):
+    """
+    Consume an NDJSON /api/generate stream and return a result shaped like the
+    non-streamed one. With expected_lines, stop reading once that many non-empty
+    lines (matching line_pattern, if given) are complete; the connection is then
+    closed, which makes Ollama stop generating, and the result has "aborted": True
+    and no timing fields; its response holds only those lines, never the start of
+    the next one. A reply ended by num_predict has "capped": True, and one with
+    expected_lines but no translated line "malformed": True.
+    """
+    stream_stats.streams += 1
+    text = ''
+    streamed = 0
+    async for line in response.content:
+        if not line.strip():
+            continue
+        try:
+            chunk = json.loads(line)
+        except ValueError:
+            raise aiohttp.ClientPayloadError(f"Malformed stream chunk: {line[:100]!r}")
+        if 'error' in chunk:
+            raise aiohttp.ClientPayloadError(chunk['error'])
+        piece = chunk.get('response', '')
+        text += piece
+        streamed += 1
+        if chunk.get('done'):
+            stream_stats.tokens_streamed += chunk.get('eval_count', streamed)
+            if chunk.get('done_reason') == 'length':
+                stream_stats.capped += 1
+                chunk['capped'] = True
+            if expected_lines:
+                lines = text.split('\n')
+                while lines and (not lines[0].strip() or PREAMBLE_RE.match(lines[0])):
+                    lines.pop(0)  # An introduction before the translation
+                text = '\n'.join(lines)
+                if not reply_lines(text, line_pattern):
+                    chunk['malformed'] = True
+            chunk['response'] = text
+            return chunk
+        if expected_lines and '\n' in piece:
+            lines = complete_lines(text, line_pattern)
+            if len(lines) >= expected_lines:
+                response.close()
+                stream_stats.stopped_early += 1
+                stream_stats.tokens_streamed += streamed
+                if num_predict:
+                    stream_stats.tokens_saved += max(num_predict - streamed, 0)
+                return {"response": '\n'.join(lines[:expected_lines]), "done": False, "aborted": True,
+                        "eval_count": streamed}
+    raise aiohttp.ClientPayloadError("Ollama stream ended without a final chunk")
@@ -0,0 +1,62 @@
+import asyncio
+
+class LeaderCancelled(Exception):
+    """
+    Set on a shared future when the caller running the coroutine was cancelled;
+    the waiting callers were not, so one of them takes the work over.
+    """
+
+class SingleFlight:
+    """
+    Coalesce concurrent calls with the same key: the first caller runs the
+    coroutine, later callers with the key await the same future until it
+    finishes. If the first caller is cancelled, a waiting caller runs the
+    coroutine again instead of failing with it. Counts calls, coalesced calls
+    and backend executions (reported by the coroutine through executed(), since
+    a call answered from a cache never reaches the backend) so the dedupe ratio
+    can be reported at the end of a run.
+    """
+    def __init__(self):
+        self.calls = 0
+        self.executions = 0
+        self.coalesced = 0
+        self._in_flight = {}
+
+    def executed(self):
+        self.executions += 1
+
+    async def do(self, key, coro_factory):
+        self.calls += 1
+        while True:
+            future = self._in_flight.get(key)
+            if future is None:
+                return await self._lead(key, coro_factory)
+            try:
+                result = await asyncio.shield(future)
+            except LeaderCancelled:
+                continue
+            self.coalesced += 1
+            return result
+
+    async def _lead(self, key, coro_factory):
+        future = asyncio.get_running_loop().create_future()
+        self._in_flight[key] = future
+        try:
+            result = await coro_factory()
+        except asyncio.CancelledError:
+            future.set_exception(LeaderCancelled())
+            future.exception()  # Mark retrieved in case nobody else was waiting
+            raise
+        except BaseException as e:
+            future.set_exception(e)
+            future.exception()
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            del self._in_flight[key]
+
+    def summary(self):
+        ratio = self.coalesced / self.calls if self.calls else 0.0
+        return f"{self.calls} requests, {self.executions} backend calls, {self.coalesced} coalesced ({ratio:.1%} deduplicated)"
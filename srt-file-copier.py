@@ -1,49 +1,118 @@
 import os
 import shutil
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from tqdm import tqdm
+from media_inventory import load_inventory
+from translation_manifest import file_hash
+
+MIRROR_DIR = "SRT_files"
+MAX_WORKERS = 8  # Parallel copies; a NAS usually keeps up with several at once
+LINK_MODE = None  # None to copy, "hardlink" or "reflink" to share data when source and mirror are on one filesystem
+VERIFY_HASH = False  # Compare contents instead of size and mtime before skipping (reads both files)
+DELETE_ORPHANS = True  # Remove mirrored files whose source SRT is gone
+MTIME_TOLERANCE = 1.0  # Seconds; some filesystems store coarser timestamps than the source
+
+FICLONE = 0x40049409  # Linux ioctl that makes dst share src's blocks (btrfs, XFS)
+
+def format_size(size):
+    for unit in ('B', 'KB', 'MB', 'GB'):
+        if size < 1024 or unit == 'GB':
+            return f"{size:.1f} {unit}" if unit != 'B' else f"{size} B"
+        size /= 1024
+
+def up_to_date(src_path, dst_path):
+    try:
+        dst_stat = os.stat(dst_path)
+    except FileNotFoundError:
+        return False
+    src_stat = os.stat(src_path)
+    if src_stat.st_size != dst_stat.st_size:
+        return False
+    if VERIFY_HASH:
+        return file_hash(src_path) == file_hash(dst_path)
+    return abs(src_stat.st_mtime - dst_stat.st_mtime) <= MTIME_TOLERANCE
+
+def reflink(src_path, tmp_path):
+    import fcntl  # Not available on Windows; the caller falls back to a copy
+    with open(src_path, 'rb') as src, open(tmp_path, 'wb') as dst:
+        fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+    shutil.copystat(src_path, tmp_path)
+
+def mirror_file(src_path, dst_path, link_mode=LINK_MODE):
+    """
+    Bring dst_path up to date with src_path. Returns (copied, size). The new file
+    is put in place with a rename, so an interrupted run never leaves a partial
+    copy behind.
+    """
+    size = os.path.getsize(src_path)
+    if up_to_date(src_path, dst_path):
+        return False, size
+
+    os.makedirs(os.path.dirname(dst_path), exist_ok=True)
+    tmp_path = f"{dst_path}.tmp"
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+    try:
+        if link_mode == "hardlink":
+            os.link(src_path, tmp_path)
+        elif link_mode == "reflink":
+            reflink(src_path, tmp_path)
+        else:
+            shutil.copy2(src_path, tmp_path)
+    except (OSError, ImportError):
+        # Different filesystem or no reflink support: fall back to a plain copy
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        shutil.copy2(src_path, tmp_path)
+    os.replace(tmp_path, dst_path)
+    return True, size
 
 def copy_srt_files():
     # Get the current working directory
     source_dir = os.getcwd()
-    
+
     # Create the destination directory
-    destination_dir = os.path.join(source_dir, "SRT_files")
+    destination_dir = os.path.join(source_dir, MIRROR_DIR)
     if not os.path.exists(destination_dir):
         os.makedirs(destination_dir)
 
-    # Get the total number of .srt files
-    total_files = sum([len(files) for r, d, files in os.walk(source_dir) if any(f.endswith('.srt') for f in files)])
-
-    # Create a progress bar
-    with tqdm(total=total_files, unit='file') as pbar:
-        # Walk through the source directory
-        for root, dirs, files in os.walk(source_dir):
-            # Skip the SRT_files directory
-            if "SRT_files" in dirs:
-                dirs.remove("SRT_files")
-            
-            # Filter for .srt files
-            srt_files = [f for f in files if f.endswith('.srt')]
-            
-            for file in srt_files:
-                # Get the full path of the source file
-                src_path = os.path.join(root, file)
-                
-                # Create the corresponding path in the destination directory
-                rel_path = os.path.relpath(root, source_dir)
-                dest_path = os.path.join(destination_dir, rel_path)
-                
-                # Create the destination directory if it doesn't exist
-                if not os.path.exists(dest_path):
-                    os.makedirs(dest_path)
-                
-                # Copy the file
-                shutil.copy2(src_path, dest_path)
-                
-                # Update the progress bar
-                pbar.update(1)
-
-    print(f"All SRT files have been copied to {destination_dir}")
+    # Get the .srt files from the shared inventory, leaving out any folder named
+    # like the mirror, at whatever depth
+    inventory = load_inventory(source_dir)
+    srt_files = [src_path for src_path, _, _ in inventory.files('.srt')
+                 if MIRROR_DIR not in os.path.relpath(src_path, source_dir).split(os.sep)[:-1]]
+    targets = {os.path.join(destination_dir, os.path.relpath(src_path, source_dir)): src_path for src_path in srt_files}
+
+    copied = skipped = removed = 0
+    copied_bytes = skipped_bytes = 0
+
+    # Copy only what changed, several files at a time
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor, tqdm(total=len(targets), unit='file') as pbar:
+        futures = {executor.submit(mirror_file, src_path, dst_path): src_path for dst_path, src_path in targets.items()}
+        for future in as_completed(futures):
+            try:
+                was_copied, size = future.result()
+            except OSError as e:
+                print(f"Failed to copy {futures[future]}: {e}")
+            else:
+                if was_copied:
+                    copied += 1
+                    copied_bytes += size
+                else:
+                    skipped += 1
+                    skipped_bytes += size
+            pbar.update(1)
+
+    # Drop mirrored files whose source no longer exists
+    if DELETE_ORPHANS:
+        for dst_path, _, _ in inventory.files('.srt'):
+            if dst_path.startswith(destination_dir + os.sep) and dst_path not in targets and os.path.exists(dst_path):
+                os.remove(dst_path)
+                removed += 1
+
+    print(f"SRT files mirrored to {destination_dir}")
+    print(f"Copied {copied} files ({format_size(copied_bytes)}), "
+          f"skipped {skipped} unchanged files ({format_size(skipped_bytes)}), removed {removed} orphans")
 
 if __name__ == "__main__":
-    copy_srt_files()
\ No newline at end of file
+    copy_srt_files()
@@ -4,6 +4,7 @@ import os
 import glob
 from concurrent.futures import ThreadPoolExecutor, as_completed
 import time
+from translation_memory import get_translation_memory
 
 def srt_to_vtt(input_file, output_file, target_language):
     try:
@@ -29,18 +30,28 @@ def srt_to_vtt(input_file, output_file, target_language):
         print(f"Error processing {input_file}: {str(e)}")
         return False
 
+MODEL = "llama3"
+PROMPT_TEMPLATE = "Translate the following text from Chinese to {target_language}. Respond with only the translated text, no additional comments: {text}"
+
 def translate_text(text, target_language):
     url = "http://localhost:11434/api/generate"
+    memory = get_translation_memory()
+    cached = memory.get(text, target_language, MODEL, PROMPT_TEMPLATE)
+    if cached is not None:
+        return cached
+
     payload = {
-        "model": "llama3",
-        "prompt": f"Translate the following text from Chinese to {target_language}. Respond with only the translated text, no additional comments: {text}",
+        "model": MODEL,
+        "prompt": PROMPT_TEMPLATE.format(target_language=target_language, text=text),
         "stream": False
     }
 
     try:
         response = requests.post(url, json=payload, timeout=30)
         response.raise_for_status()
-        return response.json()['response'].strip()
+        translation = response.json()['response'].strip()
+        memory.put(text, target_language, MODEL, PROMPT_TEMPLATE, translation)
+        return translation
     except requests.exceptions.RequestException as e:
         print(f"Translation error: {str(e)}")
         return text
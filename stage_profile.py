@@ -0,0 +1,166 @@
+import os
+import sys
+import time
+import cProfile
+import threading
+import contextlib
+import contextvars
+from collections import Counter, defaultdict
+
+# Stage timing for the translators' --profile option. Each stage is timed with
+# perf_counter around the code that does it (or, for model time, taken from what
+# Ollama reports) and charged to the file being processed, so a slow run can be
+# split into parse / queue / network / model / post-process / write. With
+# concurrent files and cues, stage totals add up across tasks and can exceed the
+# run's wall time.
+STAGES = ("parse", "queue", "network", "model", "post-process", "write")
+SAMPLE_INTERVAL = 0.005  # Seconds between stack samples for collapsed-stack output
+
+_current_file = contextvars.ContextVar("profiled_file", default=None)
+
+class StageProfiler:
+    def __init__(self):
+        self.enabled = False
+        self.started = None
+        self.files = defaultdict(lambda: defaultdict(float))  # file -> stage -> seconds
+        self._lock = threading.Lock()
+
+    def enable(self):
+        self.enabled = True
+        self.started = time.perf_counter()
+
+    @contextlib.contextmanager
+    def file(self, path):
+        """
+        Charge the stages timed inside this block (including in tasks it starts) to path.
+        """
+        token = _current_file.set(path)
+        try:
+            yield
+        finally:
+            _current_file.reset(token)
+
+    @contextlib.contextmanager
+    def _timed(self, name):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - started)
+
+    def stage(self, name):
+        if not self.enabled:
+            return contextlib.nullcontext()
+        return self._timed(name)
+
+    def add(self, name, seconds):
+        if not self.enabled:
+            return
+        with self._lock:
+            self.files[_current_file.get()][name] += seconds
+
+    def request(self, queue_seconds, elapsed, result=None):
+        """
+        Charge one Ollama request: time spent waiting for a slot, then the HTTP round
+        trip split into model time (Ollama's total_duration) and network/overhead.
+        """
+        model = elapsed
+        if result and result.get('total_duration'):
+            model = min(result['total_duration'] / 1e9, elapsed)
+        self.add("queue", queue_seconds)
+        self.add("model", model)
+        self.add("network", elapsed - model)
+
+    def report(self):
+        def row(label, stages):
+            cells = '  '.join(f"{stages.get(stage, 0.0):>12.2f}" for stage in STAGES)
+            return f"{label[-40:]:<40}  {cells}  {sum(stages.values()):>10.2f}"
+
+        header = f"{'file':<40}  " + '  '.join(f"{stage:>12}" for stage in STAGES) + f"  {'total':>10}"
+        lines = ["Stage profile (seconds, summed over concurrent tasks)", header]
+        totals = defaultdict(float)
+        for path, stages in sorted(self.files.items(), key=lambda item: -sum(item[1].values())):
+            for stage, seconds in stages.items():
+                totals[stage] += seconds
+            if path is not None:
+                lines.append(row(os.path.basename(path), stages))
+        lines.append(row("run", totals))
+        if self.started is not None:
+            lines.append(f"Wall time: {time.perf_counter() - self.started:.2f}s")
+        return '\n'.join(lines)
+
+profiler = StageProfiler()
+
+class StackSampler:
+    """
+    Samples every thread's Python stack at a fixed interval and writes them in the
+    collapsed format flamegraph.pl and speedscope read. Unlike cProfile it also
+    sees worker threads, and its overhead does not grow with the call rate.
+    """
+    def __init__(self, interval=SAMPLE_INTERVAL):
+        self.interval = interval
+        self.stacks = Counter()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _run(self):
+        me = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            for ident, frame in sys._current_frames().items():
+                if ident == me:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                self.stacks[';'.join(reversed(stack))] += 1
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def write(self, path):
+        with open(path, 'w', encoding='utf-8') as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f"{stack} {count}\n")
+
+def add_profile_arguments(parser):
+    parser.add_argument("--profile", action="store_true",
+                        help="time each stage (parse, queue, network, model, post-process, write) and print a breakdown")
+    parser.add_argument("--profile-output", metavar="PATH",
+                        help="with --profile, also write a cProfile dump (PATH ending in .prof) "
+                             "or collapsed stacks for flame graphs (any other PATH)")
+
+@contextlib.contextmanager
+def profiling(args):
+    """
+    Wrap a run according to --profile / --profile-output; a no-op without --profile.
+    """
+    if not args.profile:
+        yield
+        return
+    profiler.enable()
+    profile = sampler = None
+    if args.profile_output and args.profile_output.endswith('.prof'):
+        profile = cProfile.Profile()
+        profile.enable()
+    elif args.profile_output:
+        sampler = StackSampler()
+        sampler.start()
+    try:
+        yield
+    finally:
+        if profile is not None:
+            profile.disable()
+            profile.dump_stats(args.profile_output)
+        if sampler is not None:
+            sampler.stop()
+            sampler.write(args.profile_output)
+        print(profiler.report())
+        if args.profile_output:
+            print(f"Profile written to {args.profile_output}")
@@ -0,0 +1,76 @@
+import unittest
+import translation_memory
+from translation_memory import TranslationMemory
+from google_batch_translate import MODEL, MAX_SEGMENTS, MAX_CHARS, pack_segments, translate_texts
+
+class FakeTranslateClient:
+    """
+    Stand-in for google.cloud.translate_v2.Client: records every request and
+    answers like the v2 endpoint, HTML-escaping the translated text.
+    """
+    def __init__(self):
+        self.requests = []
+
+    def translate(self, values, target_language=None):
+        self.requests.append(list(values))
+        return [{"translatedText": f"[{target_language}] {value}".replace("'", "&#39;").replace('"', "&quot;"),
+                 "input": value}
+                for value in values]
+
+class PackSegmentsTest(unittest.TestCase):
+    def test_splits_at_the_segment_limit(self):
+        texts = [f"line {i}" for i in range(MAX_SEGMENTS * 2 + 1)]
+        batches = pack_segments(texts)
+        self.assertEqual([len(batch) for batch in batches], [MAX_SEGMENTS, MAX_SEGMENTS, 1])
+        self.assertEqual([text for batch in batches for text in batch], texts)
+
+    def test_splits_at_the_character_limit(self):
+        texts = ["x" * (MAX_CHARS // 3)] * 7
+        batches = pack_segments(texts)
+        self.assertEqual([len(batch) for batch in batches], [3, 3, 1])
+        self.assertTrue(all(sum(map(len, batch)) <= MAX_CHARS for batch in batches))
+
+    def test_oversized_text_gets_a_batch_of_its_own(self):
+        batches = pack_segments(["a", "b" * 20, "c"], max_segments=10, max_chars=10)
+        self.assertEqual(batches, [["a"], ["b" * 20], ["c"]])
+
+class TranslateTextsTest(unittest.TestCase):
+    def setUp(self):
+        self.memory = TranslationMemory(':memory:')
+        self.shared = translation_memory._shared_memory
+        translation_memory._shared_memory = self.memory
+        self.client = FakeTranslateClient()
+
+    def tearDown(self):
+        translation_memory._shared_memory = self.shared
+        self.memory.close()
+
+    def test_results_come_back_in_order(self):
+        texts = [f"第{i}句" for i in range(300)]
+        translations = translate_texts(self.client, texts, "vi")
+        self.assertEqual(translations, [f"[vi] {text}" for text in texts])
+        self.assertEqual([len(batch) for batch in self.client.requests], [MAX_SEGMENTS, MAX_SEGMENTS, 300 - 2 * MAX_SEGMENTS])
+
+    def test_repeated_blocks_are_sent_once(self):
+        texts = ["你好", "再见", "你好", "你好", "再见", "谢谢"]
+        translations = translate_texts(self.client, texts, "en")
+        self.assertEqual(self.client.requests, [["你好", "再见", "谢谢"]])
+        self.assertEqual(translations, [f"[en] {text}" for text in texts])
+
+    def test_html_entities_are_unescaped(self):
+        translations = translate_texts(self.client, ["他说\"走\"", "it's"], "en")
+        self.assertEqual(translations, ["[en] 他说\"走\"", "[en] it's"])
+
+    def test_blank_blocks_are_not_sent(self):
+        translations = translate_texts(self.client, ["", "你好", "  "], "en")
+        self.assertEqual(self.client.requests, [["你好"]])
+        self.assertEqual(translations, ["", "[en] 你好", "  "])
+
+    def test_translation_memory_hits_skip_the_request(self):
+        self.memory.put("你好", "en", MODEL, '', "Hello")
+        self.assertEqual(translate_texts(self.client, ["你好", "再见"], "en"), ["Hello", "[en] 再见"])
+        self.assertEqual(self.client.requests, [["再见"]])
+
+        # Everything is in the memory now, so a rerun makes no request at all
+        self.assertEqual(translate_texts(self.client, ["再见", "你好"], "en"), ["[en] 再见", "Hello"])
+        self.assertEqual(len(self.client.requests), 1)
@@ -0,0 +1,171 @@
+import asyncio
+import unittest
+import aiohttp
+from aiohttp import web
+from ollama_pool import EndpointPool, NoEndpointAvailable
+
+class FakeOllama:
+    """
+    Stand-in Ollama host on a free local port: /api/tags lists models and
+    /api/generate answers after a fixed delay.
+    """
+    def __init__(self, models=("qwen2.5:7b",), delay=0.0):
+        self.models = list(models)
+        self.delay = delay
+        self.generated = 0
+        self.runner = None
+        self.base_url = None
+
+    async def tags(self, request):
+        return web.json_response({"models": [{"name": name} for name in self.models]})
+
+    async def generate(self, request):
+        payload = await request.json()
+        await asyncio.sleep(self.delay)
+        self.generated += 1
+        return web.json_response({"model": payload["model"], "response": "ok", "done": True})
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_get('/api/tags', self.tags)
+        app.router.add_post('/api/generate', self.generate)
+        self.runner = web.AppRunner(app)
+        await self.runner.setup()
+        await web.TCPSite(self.runner, '127.0.0.1', 0).start()
+        self.base_url = "http://127.0.0.1:{}".format(self.runner.addresses[0][1])
+        return self
+
+    async def stop(self):
+        await self.runner.cleanup()
+
+async def generate(pool, session, model, exclude=None):
+    exclude = set() if exclude is None else exclude
+    async with pool.route(model, exclude) as endpoint:
+        async with session.post(endpoint.generate_url, json={"model": model, "prompt": "你好"}) as response:
+            response.raise_for_status()
+            await response.json()
+    return endpoint
+
+class EndpointPoolTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.servers = []
+        self.session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=5))
+
+    async def asyncTearDown(self):
+        await self.session.close()
+        for server in self.servers:
+            await server.stop()
+
+    async def serve(self, **kwargs):
+        server = await FakeOllama(**kwargs).start()
+        self.servers.append(server)
+        return server
+
+    async def start_pool(self, hosts):
+        pool = EndpointPool(hosts, check_interval=3600)
+        await pool.start(self.session)
+        self.addAsyncCleanup(pool.stop)
+        return pool
+
+    async def test_least_outstanding_routing_favours_the_fast_host(self):
+        fast = await self.serve(delay=0.01)
+        slow = await self.serve(delay=0.2)
+        pool = await self.start_pool([fast.base_url, slow.base_url])
+
+        semaphore = asyncio.Semaphore(4)
+        async def bounded():
+            async with semaphore:
+                return await generate(pool, self.session, "qwen2.5:7b")
+        await asyncio.gather(*(bounded() for _ in range(40)))
+
+        self.assertEqual(fast.generated + slow.generated, 40)
+        self.assertGreater(fast.generated, 3 * slow.generated)
+        self.assertTrue(all(endpoint.outstanding == 0 for endpoint in pool.endpoints))
+
+    async def test_select_picks_the_least_loaded_healthy_host(self):
+        first = await self.serve()
+        second = await self.serve()
+        pool = await self.start_pool([first.base_url, second.base_url])
+        busy, idle = pool.endpoints
+        busy.outstanding = 3
+        idle.outstanding = 1
+        self.assertIs(pool.select("qwen2.5:7b"), idle)
+        self.assertIs(pool.select("qwen2.5:7b", exclude={idle}), busy)
+
+    async def test_failover_when_a_host_dies(self):
+        dying = await self.serve()
+        spare = await self.serve(delay=0.05)
+        pool = await self.start_pool([dying.base_url, spare.base_url])
+        dead_endpoint, spare_endpoint = pool.endpoints
+        await dying.stop()
+        self.servers.remove(dying)
+
+        exclude = set()
+        with self.assertRaises(aiohttp.ClientError):
+            await generate(pool, self.session, "qwen2.5:7b", exclude)
+        self.assertFalse(dead_endpoint.healthy)
+        self.assertEqual(dead_endpoint.failures, 1)
+        self.assertIn(dead_endpoint, exclude)
+
+        # The caller's retry, and every later request, goes to the surviving host
+        self.assertIs(await generate(pool, self.session, "qwen2.5:7b", exclude), spare_endpoint)
+        self.assertIs(await generate(pool, self.session, "qwen2.5:7b"), spare_endpoint)
+        self.assertEqual(spare.generated, 2)
+
+    async def test_health_check_marks_hosts_down_and_back_up(self):
+        server = await self.serve()
+        url = server.base_url
+        pool = await self.start_pool([url])
+        endpoint, = pool.endpoints
+        self.assertTrue(endpoint.healthy)
+
+        await server.stop()
+        self.servers.remove(server)
+        await pool.check_all()
+        self.assertFalse(endpoint.healthy)
+
+        port = int(url.rsplit(':', 1)[1])
+        revived = FakeOllama()
+        app = web.Application()
+        app.router.add_get('/api/tags', revived.tags)
+        revived.runner = web.AppRunner(app)
+        await revived.runner.setup()
+        await web.TCPSite(revived.runner, '127.0.0.1', port).start()
+        self.servers.append(revived)
+        await pool.check_all()
+        self.assertTrue(endpoint.healthy)
+
+    async def test_routes_only_to_hosts_that_have_the_model(self):
+        qwen = await self.serve(models=["qwen2.5:7b", "gemma2:latest"])
+        llama = await self.serve(models=["llama3:8b"])
+        pool = await self.start_pool([qwen.base_url, llama.base_url])
+        qwen_endpoint, llama_endpoint = pool.endpoints
+
+        self.assertEqual(qwen_endpoint.models, {"qwen2.5:7b", "gemma2:latest"})
+        self.assertIs(pool.select("llama3:8b"), llama_endpoint)
+        self.assertIs(pool.select("gemma2"), qwen_endpoint)  # An untagged name means :latest
+        qwen_endpoint.outstanding = 10
+        self.assertIs(pool.select("qwen2.5:7b"), qwen_endpoint)
+        self.assertIsNone(pool.select("mistral:7b"))
+        with self.assertRaises(NoEndpointAvailable):
+            async with pool.route("mistral:7b"):
+                pass
+
+    async def test_unhealthy_hosts_are_a_last_resort(self):
+        first = await self.serve()
+        second = await self.serve()
+        pool = await self.start_pool([first.base_url, second.base_url])
+        first_endpoint, second_endpoint = pool.endpoints
+
+        pool.mark_failed(first_endpoint)
+        first_endpoint.outstanding = 0
+        second_endpoint.outstanding = 5
+        self.assertIs(pool.select("qwen2.5:7b"), second_endpoint)
+
+        # With every host marked down, requests still go out rather than failing outright
+        pool.mark_failed(second_endpoint)
+        self.assertIs(pool.select("qwen2.5:7b"), first_endpoint)
+        async with pool.route("qwen2.5:7b") as endpoint:
+            self.assertIs(endpoint, first_endpoint)
+            self.assertEqual(endpoint.outstanding, 1)
+        self.assertEqual(first_endpoint.outstanding, 0)
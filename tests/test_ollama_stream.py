@@ -0,0 +1,77 @@
+import re
+import json
+import asyncio
+import unittest
+from ollama_stream import read_stream, reply_lines, unusable
+
+NUMBERED_LINE_RE = re.compile(r'^\s*\[?(\d+)\s*[\]\.\):：]\s*(.*)$')
+
+class FakeContent:
+    def __init__(self, chunks):
+        self.lines = [json.dumps(chunk, ensure_ascii=False).encode('utf-8') + b'\n' for chunk in chunks]
+
+    def __aiter__(self):
+        return self._iterate()
+
+    async def _iterate(self):
+        for line in self.lines:
+            yield line
+
+class FakeResponse:
+    """
+    Stand-in for an aiohttp response carrying an NDJSON /api/generate stream.
+    """
+    def __init__(self, pieces, done_reason=None):
+        chunks = [{"response": piece} for piece in pieces]
+        if done_reason is not None:
+            chunks.append({"response": "", "done": True, "done_reason": done_reason, "eval_count": len(pieces)})
+        self.content = FakeContent(chunks)
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+def read(pieces, done_reason=None, **kwargs):
+    response = FakeResponse(pieces, done_reason)
+    return asyncio.run(read_stream(response, **kwargs)), response
+
+class ReadStreamTest(unittest.TestCase):
+    def test_abort_drops_the_start_of_the_next_line(self):
+        result, response = read(["Xin", " chào\nĐây", " là", " phần thừa"], expected_lines=1)
+        self.assertTrue(response.closed)
+        self.assertTrue(result["aborted"])
+        self.assertEqual(result["response"], "Xin chào")
+        self.assertFalse(unusable(result))
+
+    def test_abort_keeps_exactly_the_expected_lines(self):
+        result, _ = read(["Một\nHai", "\nBa\nBốn"], expected_lines=2)
+        self.assertEqual(result["response"], "Một\nHai")
+
+    def test_preamble_does_not_count_as_a_line(self):
+        result, response = read(["Đây là bản dịch:\n", "Xin chào", "\n", "Giải thích"], expected_lines=1)
+        self.assertTrue(response.closed)
+        self.assertEqual(result["response"], "Xin chào")
+
+    def test_abort_with_a_line_pattern_keeps_only_matching_lines(self):
+        result, _ = read(["Here is the translation:\n[1] Một\n", "ghi chú\n[2] Hai\n[3"], expected_lines=2,
+                         line_pattern=NUMBERED_LINE_RE)
+        self.assertEqual(result["response"], "[1] Một\n[2] Hai")
+
+    def test_finished_reply_loses_its_preamble(self):
+        result, response = read(["Bản dịch:\n", "Xin chào"], done_reason="stop", expected_lines=1)
+        self.assertFalse(response.closed)
+        self.assertEqual(result["response"], "Xin chào")
+        self.assertFalse(unusable(result))
+
+    def test_reply_with_only_a_preamble_is_unusable(self):
+        result, _ = read(["Đây là bản dịch:"], done_reason="stop", expected_lines=1)
+        self.assertTrue(result["malformed"])
+        self.assertTrue(unusable(result))
+
+    def test_length_capped_reply_is_unusable(self):
+        result, _ = read(["Xin chà"], done_reason="length", expected_lines=1)
+        self.assertTrue(result["capped"])
+        self.assertTrue(unusable(result))
+
+    def test_reply_lines_keeps_dialogue_ending_in_a_colon(self):
+        self.assertEqual(reply_lines("Anh ấy nói:\nĐây là nhà tôi.\n"), ["Anh ấy nói:", "Đây là nhà tôi."])
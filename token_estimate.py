@@ -0,0 +1,11 @@
+import re
+
+# Rough token counts for packing prompts. Local models tokenize CJK at about one
+# token per character, while Latin text averages about four characters per token.
+CJK_RE = re.compile('[\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff\uac00-\ud7af\uff00-\uffef]')
+CHARS_PER_TOKEN = 4
+
+def estimate_tokens(text):
+    non_cjk = len(CJK_RE.sub('', text))
+    cjk = len(text) - non_cjk
+    return cjk + (non_cjk + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
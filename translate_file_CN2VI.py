@@ -3,11 +3,15 @@ import re
 import requests
 import json
 from tqdm import tqdm
+from translation_memory import get_translation_memory, prompt_hash
+from ollama_session import OllamaSession, SESSION_WINDOW, SESSION_PROMPT_TEMPLATE, translate_text_in_session
+from translation_manifest import TranslationManifest
+from ollama_engine import KEEP_ALIVE  # Keeps the model and its cached system prompt loaded between cues
 
-def translate_text_with_context(text_lines, prev_lines, next_lines, target_language="Vietnamese"):
-    url = "http://localhost:11434/api/generate"
-    context = f"Previous lines: {' '.join(prev_lines)}\nCurrent lines: {' '.join(text_lines)}\nNext lines: {' '.join(next_lines)}"
-    prompt = f"""Translate the following Chinese movie subtitle to {target_language}.
+MODEL = "gemma2:27b-instruct-q8_0"
+# The instructions are the same for every cue, so they go in the system prompt,
+# which Ollama keeps evaluated; only the per-cue prompt is evaluated each time
+SYSTEM_PROMPT = """You translate Chinese movie subtitles to {target_language}.
 
     Instructions:
     1. Understand the natural meaning and nuance of the Chinese text in the context of the movie.
@@ -16,17 +20,31 @@ def translate_text_with_context(text_lines, prev_lines, next_lines, target_langu
     4. Do not include any introductions, explanations, warning or comments.
     5. Ensure the translation captures the meaning accurately, rather than translating word-for-word.
     6. Directly translate the slurs or insults words. Use same pronunciation in Chinese of character name and noun..
-    7. Maintain the style appropriate for movie subtitles (concise yet clear).
+    7. Maintain the style appropriate for movie subtitles (concise yet clear)."""
 
-    Context:
+PROMPT_TEMPLATE = """Context:
     {context}
     
     Translate only the current lines, preserving the line structure:"""
+PROMPT_ID = SYSTEM_PROMPT + PROMPT_TEMPLATE  # What the translation memory keys on
+
+def translate_text_with_context(text_lines, prev_lines, next_lines, target_language="Vietnamese"):
+    url = "http://localhost:11434/api/generate"
+    memory = get_translation_memory()
+    source_text = '\n'.join(text_lines)
+    cached = memory.get(source_text, target_language, MODEL, PROMPT_ID)
+    if cached is not None:
+        return cached.split('\n')
+
+    context = f"Previous lines: {' '.join(prev_lines)}\nCurrent lines: {' '.join(text_lines)}\nNext lines: {' '.join(next_lines)}"
+    prompt = PROMPT_TEMPLATE.format(context=context)
     
     data = {
-        "model": "gemma2:27b-instruct-q8_0",
+        "model": MODEL,
+        "system": SYSTEM_PROMPT.format(target_language=target_language),
         "prompt": prompt,
-        "stream": False
+        "stream": False,
+        "keep_alive": KEEP_ALIVE
     }
     
     response = requests.post(url, json=data)
@@ -38,7 +56,9 @@ def translate_text_with_context(text_lines, prev_lines, next_lines, target_langu
             # Ensure we have the same number of lines as the original
             while len(translated_lines) < len(text_lines):
                 translated_lines.append('')
-            return translated_lines[:len(text_lines)]
+            translated_lines = translated_lines[:len(text_lines)]
+            memory.put(source_text, target_language, MODEL, PROMPT_ID, '\n'.join(translated_lines))
+            return translated_lines
         except json.JSONDecodeError:
             print(f"Error decoding JSON: {response.text}")
             return None
@@ -46,7 +66,10 @@ def translate_text_with_context(text_lines, prev_lines, next_lines, target_langu
         print(f"Error: {response.status_code}")
         return None
 
-def srt_to_vtt(input_file, output_file):
+SESSION_MODE = False  # Chain each file's cues on one Ollama KV context (see ollama_session.py)
+PROMPT_VERSION = prompt_hash(PROMPT_ID + SESSION_PROMPT_TEMPLATE)  # Changing a prompt retranslates
+
+def srt_to_vtt(input_file, output_file, session_mode=SESSION_MODE):
     with open(input_file, 'r', encoding='utf-8') as infile:
         lines = infile.readlines()
 
@@ -57,6 +80,7 @@ def srt_to_vtt(input_file, output_file):
         outfile.write("WEBVTT\n\n")
         
         pbar = tqdm(total=total_lines, desc="Translating", unit="line")
+        session = OllamaSession(MODEL, SESSION_PROMPT_TEMPLATE.format(target_language="Vietnamese"), SESSION_WINDOW) if session_mode else None
         
         subtitle_blocks = []
         current_block = []
@@ -80,7 +104,10 @@ def srt_to_vtt(input_file, output_file):
             prev_lines = subtitle_blocks[i-1][2:] if i > 0 else []
             next_lines = subtitle_blocks[i+1][2:] if i < len(subtitle_blocks) - 1 else []
             
-            translated_lines = translate_text_with_context(text_lines, prev_lines, next_lines)
+            if session is not None:
+                translated_lines = translate_text_in_session(session, text_lines)
+            else:
+                translated_lines = translate_text_with_context(text_lines, prev_lines, next_lines)
             if translated_lines:
                 for line in translated_lines:
                     outfile.write(f"{line}\n")
@@ -96,15 +123,14 @@ def srt_to_vtt(input_file, output_file):
     
     print(f"Translation complete. Translated {translated_count} lines.")
 
-def file_already_translated(input_file, output_file):
+def file_already_translated(manifest, input_file, output_file):
     """
-    Check if the output file already exists and is newer than the input file.
+    Check the manifest for an output made from this exact SRT content with the
+    current model and prompt.
     """
-    if not os.path.exists(output_file):
-        return False
-    return os.path.getmtime(output_file) > os.path.getmtime(input_file)
+    return manifest.is_current(input_file, output_file, MODEL, PROMPT_VERSION)
 
-def process_directory(input_dir):
+def process_directory(input_dir, manifest):
     srt_files = [f for f in os.listdir(input_dir) if f.endswith('.srt')]
     srt_files.sort(key=lambda f: int(re.search(r'\d+', f).group()) if re.search(r'\d+', f) else float('inf'))
     
@@ -115,7 +141,7 @@ def process_directory(input_dir):
         name, _ = os.path.splitext(srt_file)
         output_path = os.path.join(input_dir, f"{name}_vi.vtt")
         
-        if file_already_translated(input_path, output_path):
+        if file_already_translated(manifest, input_path, output_path):
             print(f"\nSkipping file {i}/{total_files}: {srt_file} (already translated)")
             continue
         
@@ -123,14 +149,17 @@ def process_directory(input_dir):
         print(f"Output will be saved to: {output_path}")
         
         srt_to_vtt(input_path, output_path)
+        manifest.record(input_path, output_path, MODEL, PROMPT_VERSION)
 
 def process_folders(root_dir):
+    manifest = TranslationManifest(root_dir)
     for dirpath, dirnames, filenames in os.walk(root_dir):
         srt_files = [f for f in filenames if f.endswith('.srt')]
         if srt_files:
             print(f"\nProcessing folder: {dirpath}")
             print(f"Found {len(srt_files)} SRT files")
-            process_directory(dirpath)
+            process_directory(dirpath, manifest)
+    manifest.close()
 
 def main():
     current_dir = os.getcwd()
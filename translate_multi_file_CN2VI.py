@@ -4,11 +4,10 @@ import requests
 import json
 from tqdm import tqdm
 import concurrent.futures
+from translation_memory import get_translation_memory
 
-def translate_text_with_context(text_lines, prev_lines, next_lines, target_language="Vietnamese"):
-    url = "http://localhost:11434/api/generate"
-    context = f"Previous lines: {' '.join(prev_lines)}\nCurrent lines: {' '.join(text_lines)}\nNext lines: {' '.join(next_lines)}"
-    prompt = f"""Translate the following Chinese movie subtitle to {target_language}.
+MODEL = "gemma2:27b-instruct-q8_0"
+PROMPT_TEMPLATE = """Translate the following Chinese movie subtitle to {target_language}.
 
     Instructions:
     1. Understand the natural meaning and nuance of the Chinese text in the context of the movie.
@@ -23,9 +22,20 @@ def translate_text_with_context(text_lines, prev_lines, next_lines, target_langu
     {context}
     
     Translate only the current lines, preserving the line structure:"""
+
+def translate_text_with_context(text_lines, prev_lines, next_lines, target_language="Vietnamese"):
+    url = "http://localhost:11434/api/generate"
+    memory = get_translation_memory()
+    source_text = '\n'.join(text_lines)
+    cached = memory.get(source_text, target_language, MODEL, PROMPT_TEMPLATE)
+    if cached is not None:
+        return cached.split('\n')
+
+    context = f"Previous lines: {' '.join(prev_lines)}\nCurrent lines: {' '.join(text_lines)}\nNext lines: {' '.join(next_lines)}"
+    prompt = PROMPT_TEMPLATE.format(target_language=target_language, context=context)
     
     data = {
-        "model": "gemma2:27b-instruct-q8_0",
+        "model": MODEL,
         "prompt": prompt,
         "stream": False
     }
@@ -39,7 +49,9 @@ def translate_text_with_context(text_lines, prev_lines, next_lines, target_langu
             # Ensure we have the same number of lines as the original
             while len(translated_lines) < len(text_lines):
                 translated_lines.append('')
-            return translated_lines[:len(text_lines)]
+            translated_lines = translated_lines[:len(text_lines)]
+            memory.put(source_text, target_language, MODEL, PROMPT_TEMPLATE, '\n'.join(translated_lines))
+            return translated_lines
         except json.JSONDecodeError:
             print(f"Error decoding JSON: {response.text}")
             return None
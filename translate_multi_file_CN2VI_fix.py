@@ -1,14 +1,27 @@
 import os
 import re
-import requests
-import json
+import asyncio
+import argparse
 from tqdm import tqdm
-import concurrent.futures
+from translation_memory import get_translation_memory, prompt_hash
+from token_estimate import estimate_tokens
+from ollama_session import OllamaSession, SESSION_WINDOW, SESSION_PROMPT_TEMPLATE, atranslate_text_in_session
+from ollama_engine import OllamaEngine
+from ollama_stream import stream_options, stream_stats
+from ollama_metrics import metrics, METRICS_SUMMARY_NAME
+from cascade import SMALL_MODEL, check_translation, cascade_stats
+from translation_manifest import TranslationManifest
+from cue_diff import cue_hash, reusable_translations
+from media_inventory import load_inventory
+from stage_profile import profiler, profiling, add_profile_arguments
 
-def translate_text_with_context(text_lines, prev_lines, next_lines, target_language="Vietnamese"):
-    url = "http://localhost:11434/api/generate"
-    context = f"Previous lines: {' '.join(prev_lines)}\nCurrent lines: {' '.join(text_lines)}\nNext lines: {' '.join(next_lines)}"
-    prompt = f"""Translate the following Chinese movie subtitle to {target_language}.
+MODEL = "gemma2:27b-instruct-q8_0"
+MAX_REQUESTS_PER_FILE = None  # In-flight cue requests per file; None lets any file take idle run-wide slots
+MAX_CONCURRENT_FILES = 5  # Files open at once across the whole corpus
+# The instructions are the same for every cue, so they go in the system prompt:
+# Ollama keeps the evaluated prefix cached (and the model loaded, see KEEP_ALIVE
+# in ollama_engine.py) and only the per-cue prompt below is evaluated each time.
+SYSTEM_PROMPT = """You translate Chinese movie subtitles to {target_language}.
 
     Instructions:
     1. Understand the natural meaning and nuance of the Chinese text in the context of the movie.
@@ -17,58 +30,282 @@ def translate_text_with_context(text_lines, prev_lines, next_lines, target_langu
     4. Do not include any introductions, explanations, warning or comments.
     5. Ensure the translation captures the meaning accurately, rather than translating word-for-word.
     6. Directly translate the slurs or insults words. Use same pronunciation in Chinese of character name and noun..
-    7. Maintain the style appropriate for movie subtitles (concise yet clear).
+    7. Maintain the style appropriate for movie subtitles (concise yet clear)."""
 
-    Context:
+PROMPT_TEMPLATE = """Context:
     {context}
     
     Translate only the current lines, preserving the line structure:"""
+PROMPT_ID = SYSTEM_PROMPT + PROMPT_TEMPLATE  # What the translation memory keys on
+
+async def translate_text_with_context(engine, text_lines, prev_lines, next_lines, target_language="Vietnamese", limiter=None,
+                                      model=MODEL, check=None):
+    """
+    Translate one cue with its neighbours as context. check, if given, is called with
+    the source and raw translated lines and returns a list of problems; a translation
+    with any is discarded (None is returned) instead of cached.
+    """
+    memory = get_translation_memory()
+    source_text = '\n'.join(text_lines)
+    cached = memory.get(source_text, target_language, model, PROMPT_ID)
+    if cached is not None:
+        return cached.split('\n')
+
+    context = f"Previous lines: {' '.join(prev_lines)}\nCurrent lines: {' '.join(text_lines)}\nNext lines: {' '.join(next_lines)}"
+    prompt = PROMPT_TEMPLATE.format(context=context)
     
     data = {
-        "model": "gemma2:27b-instruct-q8_0",
+        "model": model,
+        "system": SYSTEM_PROMPT.format(target_language=target_language),
         "prompt": prompt,
-        "stream": False
+        **stream_options(source_text, len(text_lines))
     }
     
-    response = requests.post(url, json=data)
-    if response.status_code == 200:
-        try:
-            result = response.json()
-            translation = result.get('response', '')
-            translated_lines = translation.strip().split('\n')
-            # Ensure we have the same number of lines as the original
-            while len(translated_lines) < len(text_lines):
-                translated_lines.append('')
-            return translated_lines[:len(text_lines)]
-        except json.JSONDecodeError:
-            print(f"Error decoding JSON: {response.text}")
-            return None
-    else:
-        print(f"Error: {response.status_code}")
+    result = await engine.generate(data, limiter, expected_lines=len(text_lines))
+    if result is None:
+        return None
+    translation = result.get('response', '')
+    translated_lines = translation.strip().split('\n')
+    if check is not None and check(text_lines, translated_lines):
         return None
+    # Ensure we have the same number of lines as the original
+    while len(translated_lines) < len(text_lines):
+        translated_lines.append('')
+    translated_lines = translated_lines[:len(text_lines)]
+    memory.put(source_text, target_language, model, PROMPT_ID, '\n'.join(translated_lines))
+    return translated_lines
 
-def srt_to_vtt(input_file, output_file):
-    with open(input_file, 'r', encoding='utf-8') as infile:
-        lines = infile.readlines()
+BATCH_SYSTEM_PROMPT = """You translate numbered Chinese movie subtitles to {target_language}.
 
-    total_lines = len(lines)
-    translated_count = 0
+    Instructions:
+    1. Understand the natural meaning and nuance of the Chinese text in the context of the movie.
+    2. Express this meaning naturally in {target_language}, as if originally written in {target_language}.
+    3. Keep the original phrase.
+    4. Do not include any introductions, explanations, warning or comments.
+    5. Ensure the translation captures the meaning accurately, rather than translating word-for-word.
+    6. Directly translate the slurs or insults words. Use same pronunciation in Chinese of character name and noun..
+    7. Maintain the style appropriate for movie subtitles (concise yet clear).
+    8. Translate every numbered subtitle separately. Do not merge, split or skip subtitles.
+    9. Keep the " || " separators inside a subtitle, they mark its line breaks."""
+
+BATCH_PROMPT_TEMPLATE = """Previous lines: {prev_lines}
+    Next lines: {next_lines}
+
+    Subtitles:
+    {subtitles}
+
+    Reply with one line per subtitle in the form [number] translation:"""
+BATCH_PROMPT_ID = BATCH_SYSTEM_PROMPT + BATCH_PROMPT_TEMPLATE
+
+SESSION_MODE = False  # Chain each file's cues on one Ollama KV context (see ollama_session.py)
+BATCH_SIZE = 8  # Cues per request; 1 falls back to one request per cue
+DIFF_MODE = True  # Reuse the existing output's translations for cues an edited SRT did not change
+CASCADE_MODE = False  # Translate with SMALL_MODEL first and send only cues failing its checks to MODEL (see cascade.py)
+PROMPT_VERSION = prompt_hash(PROMPT_ID + BATCH_PROMPT_ID + SESSION_PROMPT_TEMPLATE)  # Changing a prompt retranslates
+# The model the manifest records: cascade output is partly SMALL_MODEL's, so turning
+# the cascade on or off, or changing either model, retranslates
+MANIFEST_MODEL = f"{SMALL_MODEL}>{MODEL}" if CASCADE_MODE else MODEL
+BATCH_TOKEN_BUDGET = 600  # Estimated source tokens per batched request
+LINE_SEPARATOR = " || "
+NUMBERED_LINE_RE = re.compile(r'^\s*\[?(\d+)\s*[\]\.\):：]\s*(.*)$')
+
+def parse_srt_blocks(lines):
+    subtitle_blocks = []
+    current_block = []
+    for line in lines:
+        line = line.strip()
+        if re.match(r'^\d+$', line):
+            if current_block:
+                subtitle_blocks.append(current_block)
+                current_block = []
+        current_block.append(line)
+    if current_block:
+        subtitle_blocks.append(current_block)
+    return subtitle_blocks
+
+def cue_text_lines(block):
+    return [line for line in block if line and not re.match(r'^\d+$', line) and '-->' not in line]
+
+def build_batches(cue_ids, cue_lines, batch_size=BATCH_SIZE, token_budget=BATCH_TOKEN_BUDGET):
+    """
+    Group consecutive cue ids into batches capped by cue count and estimated token budget.
+    """
+    batches = []
+    current = []
+    current_tokens = 0
+    for i in cue_ids:
+        tokens = estimate_tokens(LINE_SEPARATOR.join(cue_lines[i]))
+        contiguous = not current or current[-1] == i - 1
+        if current and (not contiguous or len(current) >= batch_size or current_tokens + tokens > token_budget):
+            batches.append(current)
+            current = []
+            current_tokens = 0
+        current.append(i)
+        current_tokens += tokens
+    if current:
+        batches.append(current)
+    return batches
+
+def parse_numbered_response(translation, batch, cue_lines):
+    """
+    Map "[n] text" lines back onto the cues of a batch. Cues that are missing or whose
+    line count does not match the source are left out so they can be retried.
+    """
+    numbered = {}
+    for line in translation.strip().split('\n'):
+        match = NUMBERED_LINE_RE.match(line)
+        if match:
+            numbered.setdefault(int(match.group(1)), match.group(2).strip())
+
+    results = {}
+    for n, i in enumerate(batch, 1):
+        if n not in numbered:
+            continue
+        parts = [part.strip() for part in numbered[n].split(LINE_SEPARATOR.strip())]
+        if len(parts) != len(cue_lines[i]):
+            if len(cue_lines[i]) != 1:
+                continue
+            parts = [' '.join(parts)]
+        results[i] = parts
+    return results
+
+async def translate_batch_with_context(engine, batch, cue_lines, prev_lines, next_lines, target_language="Vietnamese", limiter=None,
+                                       model=MODEL):
+    subtitles = '\n    '.join(f"[{n}] {LINE_SEPARATOR.join(cue_lines[i])}" for n, i in enumerate(batch, 1))
+    prompt = BATCH_PROMPT_TEMPLATE.format(
+        prev_lines=' '.join(prev_lines),
+        next_lines=' '.join(next_lines),
+        subtitles=subtitles
+    )
+
+    data = {
+        "model": model,
+        "system": BATCH_SYSTEM_PROMPT.format(target_language=target_language),
+        "prompt": prompt,
+        # Numbered replies may be spaced with blank lines, so no stop sequence here
+        **stream_options(subtitles, len(batch), stop=None)
+    }
+
+    result = await engine.generate(data, limiter, expected_lines=len(batch), line_pattern=NUMBERED_LINE_RE)
+    if result is None:
+        return {}
+    return parse_numbered_response(result.get('response', ''), batch, cue_lines)
 
-    with open(output_file, 'w', encoding='utf-8') as outfile:
-        outfile.write("WEBVTT\n\n")
-        
-        subtitle_blocks = []
-        current_block = []
-        for line in lines:
-            line = line.strip()
-            if re.match(r'^\d+$', line):
-                if current_block:
-                    subtitle_blocks.append(current_block)
-                    current_block = []
-            current_block.append(line)
-        if current_block:
-            subtitle_blocks.append(current_block)
+async def translate_cues(engine, subtitle_blocks, cue_lines, target_language="Vietnamese", batch_size=BATCH_SIZE,
+                         session_mode=SESSION_MODE, max_requests=MAX_REQUESTS_PER_FILE, progress=None, reuse=None,
+                         cascade=CASCADE_MODE):
+    """
+    Translate every cue of a file, returning a list aligned with subtitle_blocks
+    (None where translation failed). Cues and batches run concurrently, at most
+    max_requests at a time for this file (unbounded apart from the engine's
+    run-wide cap when None). progress, if given, is updated once per cue. reuse
+    maps cue index -> translated lines already known (diff mode); those cues are
+    not sent. With cascade, cues go to SMALL_MODEL first and only those whose
+    translation fails check_translation are translated again with MODEL.
+    """
+    reuse = reuse or {}
+    translations = [reuse.get(i) for i in range(len(subtitle_blocks))]
+    context_lines = [block[2:] for block in subtitle_blocks]
+    limiter = asyncio.Semaphore(max_requests) if max_requests else None
 
+    def done(count=1):
+        if progress is not None:
+            progress.update(count)
+
+    def checked(source_lines, translated_lines):
+        problems = check_translation(source_lines, translated_lines)
+        cascade_stats.record(problems)
+        return problems
+
+    async def single(i, small_first=cascade):
+        prev_lines = context_lines[i-1] if i > 0 else []
+        next_lines = context_lines[i+1] if i < len(subtitle_blocks) - 1 else []
+        if small_first:
+            translations[i] = await translate_text_with_context(engine, cue_lines[i], prev_lines, next_lines, target_language,
+                                                                limiter, model=SMALL_MODEL, check=checked)
+        if translations[i] is None:
+            translations[i] = await translate_text_with_context(engine, cue_lines[i], prev_lines, next_lines, target_language, limiter)
+        done()
+
+    pending = [i for i, lines in enumerate(cue_lines) if lines and i not in reuse]
+    done(len(reuse))
+    if session_mode:
+        # Each request needs the previous context, so a session runs cue by cue
+        session = OllamaSession(MODEL, SESSION_PROMPT_TEMPLATE.format(target_language=target_language), SESSION_WINDOW)
+        for i in pending:
+            translations[i] = await atranslate_text_in_session(engine, session, cue_lines[i], target_language)
+            done()
+        return translations
+
+    if batch_size <= 1:
+        await asyncio.gather(*(single(i) for i in pending))
+        return translations
+
+    memory = get_translation_memory()
+    uncached = []
+    for i in pending:
+        source_text = '\n'.join(cue_lines[i])
+        cached = memory.get(source_text, target_language, MODEL, BATCH_PROMPT_ID)
+        if cached is None:
+            cached = memory.get(source_text, target_language, MODEL, PROMPT_ID)
+        if cached is None and cascade:
+            cached = memory.get(source_text, target_language, SMALL_MODEL, BATCH_PROMPT_ID)
+        if cached is not None:
+            translations[i] = cached.split('\n')
+        else:
+            uncached.append(i)
+    done(len(pending) - len(uncached))
+
+    retry = []
+    escalate = []
+
+    async def batched(batch, model=MODEL):
+        prev_lines = context_lines[batch[0]-1] if batch[0] > 0 else []
+        next_lines = context_lines[batch[-1]+1] if batch[-1] < len(subtitle_blocks) - 1 else []
+        results = await translate_batch_with_context(engine, batch, cue_lines, prev_lines, next_lines, target_language, limiter, model)
+        for i in batch:
+            if model == SMALL_MODEL and checked(cue_lines[i], results.get(i)):
+                escalate.append(i)
+            elif i in results:
+                translations[i] = results[i]
+                memory.put('\n'.join(cue_lines[i]), target_language, model, BATCH_PROMPT_ID, '\n'.join(results[i]))
+                done()
+            else:
+                retry.append(i)
+
+    if cascade:
+        await asyncio.gather(*(batched(batch, SMALL_MODEL) for batch in build_batches(uncached, cue_lines, batch_size)))
+        uncached = sorted(escalate)
+    await asyncio.gather(*(batched(batch) for batch in build_batches(uncached, cue_lines, batch_size)))
+
+    # Only the cues whose numbered line could not be parsed go out again, one by one
+    await asyncio.gather(*(single(i, small_first=False) for i in sorted(retry)))
+    return translations
+
+async def srt_to_vtt(engine, input_file, output_file, batch_size=BATCH_SIZE, session_mode=SESSION_MODE, progress=None, previous=None):
+    """
+    Translate input_file into output_file and return the [(text hash, line count, failed), ...]
+    of the cues written, for the manifest. previous is that list from the run that
+    wrote the current output_file; with it, unchanged cues keep their translation.
+    """
+    with profiler.stage("parse"):
+        with open(input_file, 'r', encoding='utf-8') as infile:
+            lines = infile.readlines()
+
+        subtitle_blocks = parse_srt_blocks(lines)
+        cue_lines = [cue_text_lines(block) if len(block) >= 2 else [] for block in subtitle_blocks]
+        # Text of the cues that make it into the output, None for blocks that are skipped
+        written = [text if len(block) >= 2 and any('-->' in line for line in block) else None
+                   for block, text in zip(subtitle_blocks, cue_lines)]
+        reuse = reusable_translations(previous, output_file, written)
+    if reuse:
+        print(f"Diff mode: reusing {len(reuse)} unchanged cues of {output_file}")
+    translations = await translate_cues(engine, subtitle_blocks, cue_lines, batch_size=batch_size,
+                                        session_mode=session_mode, progress=progress, reuse=reuse)
+
+    translated_count = 0
+    output = ["WEBVTT\n\n"]
+    with profiler.stage("post-process"):
         for i, block in enumerate(subtitle_blocks):
             if len(block) < 2:
                 print(f"Warning: Skipping malformed subtitle block: {block}")
@@ -76,79 +313,141 @@ def srt_to_vtt(input_file, output_file):
 
             # Write subtitle number (if available)
             if re.match(r'^\d+$', block[0]):
-                outfile.write(f"{block[0]}\n")
+                output.append(f"{block[0]}\n")
 
             # Write timestamp
             timestamp = next((line for line in block if '-->' in line), None)
             if timestamp:
-                outfile.write(f"{timestamp.replace(',', '.')}\n")
+                output.append(f"{timestamp.replace(',', '.')}\n")
             else:
                 print(f"Warning: No timestamp found in block: {block}")
                 continue
 
-            # Extract and translate text lines
-            text_lines = [line for line in block if line and not re.match(r'^\d+$', line) and '-->' not in line]
-            prev_lines = subtitle_blocks[i-1][2:] if i > 0 else []
-            next_lines = subtitle_blocks[i+1][2:] if i < len(subtitle_blocks) - 1 else []
-            
-            translated_lines = translate_text_with_context(text_lines, prev_lines, next_lines)
+            text_lines = cue_lines[i]
+            translated_lines = translations[i]
             if translated_lines:
                 for line in translated_lines:
-                    outfile.write(f"{line}\n")
+                    output.append(f"{line}\n")
                 translated_count += len(text_lines)
             else:
                 for line in text_lines:
-                    outfile.write(f"{line}\n")
+                    output.append(f"{line}\n")
                 print(f"Warning: Could not translate lines: {' '.join(text_lines)}")
-            
-            outfile.write("\n")
+
+            output.append("\n")
+
+    with profiler.stage("write"):
+        with open(output_file, 'w', encoding='utf-8') as outfile:
+            outfile.write(''.join(output))
     
     print(f"Translation complete. Translated {translated_count} lines.")
+    # A failed cue was written with its source text: flag it so it is never reused as a translation
+    return [(cue_hash(text), len(text), bool(text) and not translations[i])
+            for i, text in enumerate(written) if text is not None]
 
-def file_already_translated(input_file, output_file):
-    if not os.path.exists(output_file):
-        return False
-    return os.path.getmtime(output_file) > os.path.getmtime(input_file)
+def file_already_translated(manifest, input_file, output_file):
+    return manifest.is_current(input_file, output_file, MANIFEST_MODEL, PROMPT_VERSION)
 
-def process_file(file_info):
-    input_path, output_path = file_info
-    if file_already_translated(input_path, output_path):
-        return f"Skipped: {os.path.basename(input_path)} (already translated)"
-    
-    srt_to_vtt(input_path, output_path)
-    return f"Processed: {os.path.basename(input_path)}"
+def srt_sort_key(filename):
+    match = re.search(r'\d+', filename)
+    return int(match.group()) if match else float('inf')
+
+def discover_jobs(root_dir, manifest):
+    """
+    List the tree's SRT files from the media inventory and return (pending, skipped)
+    lists of (srt, vtt) path pairs.
+    """
+    pending = []
+    skipped = []
+    folders = {}
+    for path, _, _ in load_inventory(root_dir).files('.srt'):
+        folders.setdefault(os.path.dirname(path), []).append(os.path.basename(path))
+    for dirpath, srt_files in folders.items():
+        for srt_file in sorted(srt_files, key=srt_sort_key):
+            input_path = os.path.join(dirpath, srt_file)
+            name, _ = os.path.splitext(srt_file)
+            output_path = os.path.join(dirpath, f"{name}_vi.vtt")
+            if file_already_translated(manifest, input_path, output_path):
+                skipped.append((input_path, output_path))
+            else:
+                pending.append((input_path, output_path))
+    return pending, skipped
+
+def count_cues(input_path):
+    with open(input_path, 'r', encoding='utf-8') as f:
+        return sum(1 for line in f if '-->' in line)
+
+async def run_jobs(engine, jobs, manifest, max_workers=MAX_CONCURRENT_FILES):
+    """
+    Feed every pending file in the corpus through one pool of file workers. Cue
+    requests from all open files share the engine's in-flight slots, so a file
+    with many cues soaks up whatever capacity small files leave idle.
+    """
+    queue = asyncio.Queue()
+    for job in jobs:
+        queue.put_nowait(job)
+    results = {}
+    files_done = 0
+    cue_bar = tqdm(total=sum(count_cues(input_path) for input_path, _ in jobs), desc="Translating corpus", unit="cue")
+
+    async def worker():
+        nonlocal files_done
+        while not queue.empty():
+            input_path, output_path = queue.get_nowait()
+            try:
+                with profiler.file(input_path):
+                    previous = manifest.previous_cues(output_path, MANIFEST_MODEL, PROMPT_VERSION) if DIFF_MODE else None
+                    cues = await srt_to_vtt(engine, input_path, output_path, progress=cue_bar, previous=previous)
+                    with profiler.stage("write"):
+                        manifest.record(input_path, output_path, MANIFEST_MODEL, PROMPT_VERSION, cues)
+                results[input_path] = f"Processed: {input_path}"
+            except Exception as e:
+                results[input_path] = f"Failed: {input_path} ({e})"
+            files_done += 1
+            cue_bar.set_postfix_str(f"files {files_done}/{len(jobs)}")
+
+    await asyncio.gather(*(worker() for _ in range(min(max_workers, len(jobs)))))
+    cue_bar.close()
+    return [results[input_path] for input_path, _ in jobs]
+
+async def process_folders(root_dir, max_workers=MAX_CONCURRENT_FILES):
+    manifest = TranslationManifest(root_dir)
+    jobs, skipped = discover_jobs(root_dir, manifest)
+    folders = {os.path.dirname(input_path) for input_path, _ in jobs + skipped}
+    print(f"Found {len(jobs) + len(skipped)} SRT files in {len(folders)} folders "
+          f"({len(skipped)} already translated, {len(jobs)} to translate)")
+    if not jobs:
+        manifest.close()
+        return
+
+    metrics.serve()
+    try:
+        async with OllamaEngine() as engine:
+            results = await run_jobs(engine, jobs, manifest, max_workers)
+    finally:
+        manifest.close()
+        metrics.write_summary(os.path.join(root_dir, METRICS_SUMMARY_NAME))
+    print(f"Ollama: {engine.summary()}")
+    print(f"Streaming: {stream_stats.summary()}")
+    if CASCADE_MODE:
+        small_seconds = engine.model_seconds.get(SMALL_MODEL, 0.0)
+        large_seconds = engine.model_seconds.get(MODEL, 0.0)
+        print(f"Cascade: {cascade_stats.summary(small_seconds, large_seconds)}")
 
-def process_directory(input_dir, max_workers=5):
-    srt_files = [f for f in os.listdir(input_dir) if f.endswith('.srt')]
-    srt_files.sort(key=lambda f: int(re.search(r'\d+', f).group()) if re.search(r'\d+', f) else float('inf'))
-    
-    file_pairs = []
-    for srt_file in srt_files:
-        input_path = os.path.join(input_dir, srt_file)
-        name, _ = os.path.splitext(srt_file)
-        output_path = os.path.join(input_dir, f"{name}_vi.vtt")
-        file_pairs.append((input_path, output_path))
-    
-    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
-        results = list(tqdm(executor.map(process_file, file_pairs), total=len(file_pairs), desc="Processing files"))
-    
     for result in results:
         print(result)
 
-def process_folders(root_dir, max_workers=5):
-    for dirpath, dirnames, filenames in os.walk(root_dir):
-        srt_files = [f for f in filenames if f.endswith('.srt')]
-        if srt_files:
-            print(f"\nProcessing folder: {dirpath}")
-            print(f"Found {len(srt_files)} SRT files")
-            process_directory(dirpath, max_workers)
-
 def main():
+    parser = argparse.ArgumentParser(description="Translate every SRT under the current folder to Vietnamese VTT.")
+    add_profile_arguments(parser)
+    args = parser.parse_args()
+
     current_dir = os.getcwd()
     print(f"Starting translation process in: {current_dir}")
     
-    max_workers = 5  # You can adjust this number based on your system's capabilities
-    process_folders(current_dir, max_workers)
+    max_workers = MAX_CONCURRENT_FILES  # You can adjust this number based on your system's capabilities
+    with profiling(args):
+        asyncio.run(process_folders(current_dir, max_workers))
     
     print("\nAll translations complete.")
 
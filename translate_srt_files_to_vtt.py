@@ -1,17 +1,12 @@
 import os
 import re
-import html
 from google.cloud import translate_v2 as translate
+from google_batch_translate import translate_texts
 
 def get_translate_client():
     translate_client = translate.Client()
     return translate_client
 
-def translate_text(translate_client, text, target_language):
-    result = translate_client.translate(text, target_language=target_language)
-    translated_text = result['translatedText']
-    return html.unescape(translated_text)
-
 def srt_to_vtt(srt_content):
     vtt_content = "WEBVTT\n\n"
     vtt_content += srt_content.replace(',', '.')
@@ -22,11 +17,10 @@ def translate_srt_file_to_vtt(translate_client, file_path, target_language):
         content = file.read()
     
     srt_blocks = re.split(r'(\d+\n\d{2}:\d{2}:\d{2},\d{3} --> \d{2}:\d{2}:\d{2},\d{3}\n)', content)
-    translated_blocks = []
-
-    for i in range(1, len(srt_blocks), 2):
-        translated_text = translate_text(translate_client, srt_blocks[i + 1], target_language)
-        translated_blocks.append(srt_blocks[i] + translated_text + '\n')
+    headers = srt_blocks[1::2]
+    texts = srt_blocks[2::2]
+    translated_texts = translate_texts(translate_client, texts, target_language)
+    translated_blocks = [header + translated_text + '\n' for header, translated_text in zip(headers, translated_texts)]
     
     translated_srt_content = ''.join(translated_blocks)
     return srt_to_vtt(translated_srt_content)
@@ -0,0 +1,131 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+
+# Per-root record of every translated artifact: the input content hash, model and
+# prompt version it was produced from and the hash and size of the output. Skip
+# decisions become one indexed lookup per output file. Touching an SRT no longer
+# forces a retranslation, and a truncated or half-written output is retranslated
+# instead of being skipped forever.
+MANIFEST_NAME = '.translation_manifest.sqlite3'
+
+def file_hash(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def count_cues(path):
+    with open(path, 'r', encoding='utf-8', errors='replace') as f:
+        return sum(1 for line in f if '-->' in line)
+
+class TranslationManifest:
+    def __init__(self, root):
+        self.root = os.path.abspath(root)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(os.path.join(self.root, MANIFEST_NAME), check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS artifacts (
+                output TEXT PRIMARY KEY,
+                input TEXT NOT NULL,
+                input_hash TEXT NOT NULL,
+                input_size INTEGER NOT NULL,
+                input_mtime_ns INTEGER NOT NULL,
+                model TEXT NOT NULL,
+                prompt_version TEXT NOT NULL,
+                output_hash TEXT NOT NULL,
+                output_size INTEGER NOT NULL,
+                updated REAL NOT NULL,
+                cues TEXT
+            )""")
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(artifacts)")}
+        if 'cues' not in columns:
+            self._conn.execute("ALTER TABLE artifacts ADD COLUMN cues TEXT")
+
+    def _key(self, path):
+        return os.path.relpath(os.path.abspath(path), self.root)
+
+    def is_current(self, input_path, output_path, model, prompt_version, verify_output=False):
+        """
+        True when output_path was produced from the current content of input_path
+        with this model and prompt version, has not been truncated since and has
+        no cue recorded as failed.
+        """
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT input_hash, input_size, input_mtime_ns, model, prompt_version, output_hash, output_size, cues "
+                "FROM artifacts WHERE output = ?", (self._key(output_path),)).fetchone()
+        if row is None:
+            return self._adopt_legacy(input_path, output_path, model, prompt_version)
+
+        input_hash, input_size, input_mtime_ns, row_model, row_prompt_version, output_hash, output_size, cues = row
+        if row_model != model or row_prompt_version != prompt_version:
+            return False
+        if cues is not None and any(len(cue) > 2 and cue[2] for cue in json.loads(cues)):
+            return False  # Retranslate; diff mode carries the finished cues over
+        try:
+            input_stat = os.stat(input_path)
+            output_stat = os.stat(output_path)
+        except FileNotFoundError:
+            return False
+        if output_stat.st_size != output_size:
+            return False
+        if verify_output and file_hash(output_path) != output_hash:
+            return False
+        if (input_stat.st_size, input_stat.st_mtime_ns) != (input_size, input_mtime_ns):
+            # Only the content matters: a touched but unchanged SRT is still current
+            if file_hash(input_path) != input_hash:
+                return False
+            with self._lock:
+                self._conn.execute(
+                    "UPDATE artifacts SET input_size = ?, input_mtime_ns = ? WHERE output = ?",
+                    (input_stat.st_size, input_stat.st_mtime_ns, self._key(output_path)))
+        return True
+
+    def _adopt_legacy(self, input_path, output_path, model, prompt_version):
+        # Outputs made before the manifest existed are trusted once if they cover
+        # every cue of their input, so enabling the manifest does not retranslate
+        # a whole library
+        if not os.path.exists(output_path) or not os.path.exists(input_path):
+            return False
+        if count_cues(output_path) < count_cues(input_path):
+            return False
+        self.record(input_path, output_path, model, prompt_version)
+        return True
+
+    def record(self, input_path, output_path, model, prompt_version, cues=None):
+        """
+        cues, if given, is the [(text hash, line count, failed), ...] of every cue
+        written to the output, kept for diff mode (see cue_diff.py).
+        """
+        input_stat = os.stat(input_path)
+        output_stat = os.stat(output_path)
+        values = (self._key(output_path), self._key(input_path), file_hash(input_path),
+                  input_stat.st_size, input_stat.st_mtime_ns, model, prompt_version,
+                  file_hash(output_path), output_stat.st_size, time.time(),
+                  json.dumps(cues) if cues is not None else None)
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO artifacts VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", values)
+
+    def previous_cues(self, output_path, model, prompt_version):
+        """
+        The cue list recorded for output_path, or None if there is none or it was
+        made with another model or prompt (its translations are not reusable then).
+        """
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT cues, model, prompt_version FROM artifacts WHERE output = ?",
+                (self._key(output_path),)).fetchone()
+        if row is None or row[0] is None or (row[1], row[2]) != (model, prompt_version):
+            return None
+        return [tuple(cue) for cue in json.loads(row[0])]
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,112 @@
+import os
+import re
+import time
+import sqlite3
+import hashlib
+import threading
+import unicodedata
+
+# Shared on-disk translation memory. Every translator looks a cue up here before
+# calling its backend, so repeated lines (opening/ending songs, interjections,
+# reruns) come back from SQLite instead of the model.
+DEFAULT_DB_PATH = os.path.join(os.path.expanduser("~"), ".cache", "batchtranslate", "translation_memory.sqlite3")
+MAX_ENTRIES = 500000  # LRU eviction kicks in above this many rows
+MAX_BYTES = 512 * 1024 * 1024  # ... or above this much stored text
+EVICT_FRACTION = 0.1  # Share of rows dropped per eviction pass
+EVICT_CHECK_EVERY = 1000  # Writes between size checks
+
+def normalize_text(text):
+    # Whitespace is collapsed within lines only: callers split a hit on '\n' and
+    # rely on the line count, so "A\nB" and "A B" must not share a key
+    text = unicodedata.normalize('NFKC', text)
+    return '\n'.join(re.sub(r'[^\S\n]+', ' ', line).strip() for line in text.strip().split('\n'))
+
+def prompt_hash(template):
+    return hashlib.sha1(template.encode('utf-8')).hexdigest()[:16]
+
+class TranslationMemory:
+    def __init__(self, db_path=DEFAULT_DB_PATH, max_entries=MAX_ENTRIES, max_bytes=MAX_BYTES):
+        self.db_path = db_path
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._writes = 0
+        self._lock = threading.Lock()
+
+        if db_path != ':memory:':
+            os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        self._conn = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS tm (
+                key TEXT PRIMARY KEY,
+                target_language TEXT NOT NULL,
+                model TEXT NOT NULL,
+                prompt_hash TEXT NOT NULL,
+                source TEXT NOT NULL,
+                translation TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                last_used REAL NOT NULL
+            )""")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS tm_last_used ON tm (last_used)")
+
+    @staticmethod
+    def make_key(text, target_language, model, template):
+        raw = '\x1f'.join([normalize_text(text), target_language, model, prompt_hash(template)])
+        return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+    def get(self, text, target_language, model, template=''):
+        key = self.make_key(text, target_language, model, template)
+        with self._lock:
+            row = self._conn.execute("SELECT translation FROM tm WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._conn.execute("UPDATE tm SET last_used = ? WHERE key = ?", (time.time(), key))
+        return row[0]
+
+    def put(self, text, target_language, model, template, translation):
+        if not translation:
+            return
+        key = self.make_key(text, target_language, model, template)
+        size = len(text.encode('utf-8')) + len(translation.encode('utf-8'))
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO tm VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (key, target_language, model, prompt_hash(template), normalize_text(text), translation, size, time.time()))
+            self._writes += 1
+            if self._writes % EVICT_CHECK_EVERY == 0:
+                self._evict()
+
+    def _evict(self):
+        count, total = self._conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM tm").fetchone()
+        if count <= self.max_entries and total <= self.max_bytes:
+            return
+        drop = max(count - self.max_entries, int(count * EVICT_FRACTION), 1)
+        self._conn.execute(
+            "DELETE FROM tm WHERE key IN (SELECT key FROM tm ORDER BY last_used LIMIT ?)", (drop,))
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        hit_rate = self.hits / lookups if lookups else 0.0
+        return {"hits": self.hits, "misses": self.misses, "hit_rate": hit_rate}
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+_shared_memory = None
+_shared_lock = threading.Lock()
+
+def get_translation_memory():
+    """
+    Return the process-wide translation memory (path overridable via TRANSLATION_MEMORY_DB).
+    """
+    global _shared_memory
+    with _shared_lock:
+        if _shared_memory is None:
+            _shared_memory = TranslationMemory(os.environ.get("TRANSLATION_MEMORY_DB", DEFAULT_DB_PATH))
+        return _shared_memory
@@ -1,63 +1,165 @@
-import requests
-import json
 import os
+import re
+import asyncio
 from tqdm import tqdm
+from translation_memory import get_translation_memory
+from token_estimate import estimate_tokens
+from ollama_engine import OllamaEngine
+from ollama_metrics import metrics, METRICS_SUMMARY_NAME
+from cue_journal import CueJournal, journal_path, source_hash, atomic_write
 
-def translate_text(text, model="gemma2:27b-instruct-q8_0"):
-    api_url = "http://localhost:11434/api/generate"
-    
-    prompt = f"""Translate the following Chinese text to Vietnamese. Do not include any introductions, explanations, warning or comments. Ensure the translation captures the meaning accurately, rather than translating word-for-word. Ingore slurs or insults remminder and translate directly. Keep the same pronounce in the roles name noun of Chinese.:
+MODEL = "gemma2:27b-instruct-q8_0"
+TARGET_LANGUAGE = "Vietnamese"
+TOKEN_BUDGET = 800  # Estimated source tokens per request; paragraphs are packed up to this
+MAX_CONCURRENT_PACKETS = 4  # Packets translated at once
+PROMPT_TEMPLATE = """Translate the following Chinese text to Vietnamese. Do not include any introductions, explanations, warning or comments. Ensure the translation captures the meaning accurately, rather than translating word-for-word. Ingore slurs or insults remminder and translate directly. Keep the same pronounce in the roles name noun of Chinese. Keep the paragraphs: separate them with one blank line, exactly as in the source.:
 
 {text}
 
 Vietnamese translation:"""
 
+# A paragraph is a run of non-blank lines
+PARAGRAPH_RE = re.compile(r'[^\n]*\S[^\n]*(?:\n[^\n]*\S[^\n]*)*')
+BLANK_LINE_RE = re.compile(r'\n\s*\n')
+
+def split_units(text, token_budget=TOKEN_BUDGET):
+    """
+    Split text into translation units and return (lead, units, separators): the
+    text is lead + units[0] + separators[0] + units[1] + ... exactly. Units are
+    paragraphs; one larger than token_budget is cut at line breaks.
+    """
+    matches = list(PARAGRAPH_RE.finditer(text))
+    if not matches:
+        return text, [], []
+    lead = text[:matches[0].start()]
+    units = []
+    separators = []
+    for n, match in enumerate(matches):
+        end = matches[n+1].start() if n + 1 < len(matches) else len(text)
+        current = []
+        current_tokens = 0
+        for line in match.group().split('\n'):
+            tokens = estimate_tokens(line)
+            if current and current_tokens + tokens > token_budget:
+                units.append('\n'.join(current))
+                separators.append('\n')
+                current = []
+                current_tokens = 0
+            current.append(line)
+            current_tokens += tokens
+        units.append('\n'.join(current))
+        separators.append(text[match.end():end])
+    return lead, units, separators
+
+def pack_units(unit_ids, units, token_budget=TOKEN_BUDGET):
+    """
+    Group consecutive unit ids into packets of at most token_budget estimated tokens.
+    """
+    packets = []
+    current = []
+    current_tokens = 0
+    for i in unit_ids:
+        tokens = estimate_tokens(units[i])
+        contiguous = not current or current[-1] == i - 1
+        if current and (not contiguous or current_tokens + tokens > token_budget):
+            packets.append(current)
+            current = []
+            current_tokens = 0
+        current.append(i)
+        current_tokens += tokens
+    if current:
+        packets.append(current)
+    return packets
+
+async def translate_text(engine, text, limiter=None):
     data = {
-        "model": model,
-        "prompt": prompt,
+        "model": MODEL,
+        "prompt": PROMPT_TEMPLATE.format(text=text),
         "stream": False
     }
+    result = await engine.generate(data, limiter)
+    if result is None:
+        return None
+    return result.get('response', '').strip()
 
-    response = requests.post(api_url, json=data)
-    if response.status_code == 200:
-        result = json.loads(response.text)
-        return result['response'].strip()
-    else:
-        return f"Error: {response.status_code} - {response.text}"
+async def translate_packet(engine, packet, units, limiter=None):
+    """
+    Translate a packet of units in one request and return {unit id: translation}.
+    If the reply does not have one paragraph per unit, the units are sent one by one.
+    """
+    translation = await translate_text(engine, '\n\n'.join(units[i] for i in packet), limiter)
+    if translation is None:
+        return {}
+    paragraphs = BLANK_LINE_RE.split(translation)
+    if len(packet) == 1:
+        return {packet[0]: translation}
+    if len(paragraphs) == len(packet):
+        return dict(zip(packet, paragraphs))
+    results = await asyncio.gather(*(translate_packet(engine, [i], units, limiter) for i in packet))
+    return {i: text for result in results for i, text in result.items()}
 
-def translate_file(input_file, output_file):
+async def translate_file(engine, input_file, output_file, token_budget=TOKEN_BUDGET, max_concurrent=MAX_CONCURRENT_PACKETS):
     with open(input_file, 'r', encoding='utf-8') as f:
         chinese_text = f.read()
-    
-    # Split the text into chunks for progress visualization
-    chunks = chinese_text.split('\n')
-    vietnamese_text = []
-    
-    # Create a progress bar
-    with tqdm(total=len(chunks), desc="Translating", unit="line") as pbar:
-        for chunk in chunks:
-            if chunk.strip():  # Only translate non-empty lines
-                translated_chunk = translate_text(chunk)
-                vietnamese_text.append(translated_chunk)
-            pbar.update(1)
-    
-    # Join the translated chunks
-    full_vietnamese_text = '\n'.join(vietnamese_text)
-    
-    with open(output_file, 'w', encoding='utf-8') as f:
-        f.write(full_vietnamese_text)
+
+    lead, units, separators = split_units(chinese_text, token_budget)
+    memory = get_translation_memory()
+
+    # Units finished by an interrupted run are read back from the journal
+    journal = CueJournal(journal_path(output_file), f"{source_hash(chinese_text)}:{token_budget}")
+    translations = {cue: text for (_, cue), text in journal.load().items()}
+    pending = []
+    for i, unit in enumerate(units):
+        if i in translations:
+            continue
+        cached = memory.get(unit, TARGET_LANGUAGE, MODEL, PROMPT_TEMPLATE)
+        if cached is not None:
+            translations[i] = cached
+            journal.record(TARGET_LANGUAGE, i, cached)
+        else:
+            pending.append(i)
+
+    limiter = asyncio.Semaphore(max_concurrent)
+    packets = pack_units(pending, units, token_budget)
+    with tqdm(total=len(units), initial=len(units) - len(pending), desc="Translating", unit="paragraph") as pbar:
+        async def run(packet):
+            results = await translate_packet(engine, packet, units, limiter)
+            for i, text in results.items():
+                translations[i] = text
+                memory.put(units[i], TARGET_LANGUAGE, MODEL, PROMPT_TEMPLATE, text)
+                journal.record(TARGET_LANGUAGE, i, text)
+            pbar.update(len(packet))
+
+        await asyncio.gather(*(run(packet) for packet in packets))
+
+    failed = [i for i in range(len(units)) if i not in translations]
+    for i in failed:
+        print(f"Warning: Could not translate paragraph {i + 1}, keeping the original text")
+
+    # Reassemble in order, with the source's blank-line structure
+    vietnamese_text = lead + ''.join(translations.get(i, unit) + separators[i] for i, unit in enumerate(units))
+    atomic_write(output_file, vietnamese_text)
+    if failed:
+        journal.close()  # Keep the finished paragraphs so a rerun only retries the failed ones
+    else:
+        journal.discard()
 
 def get_output_filename(input_file):
     directory, filename = os.path.split(input_file)
     name, ext = os.path.splitext(filename)
     return os.path.join(directory, f"{name}_vn{ext}")
 
+async def main(input_file, output_file):
+    async with OllamaEngine() as engine:
+        await translate_file(engine, input_file, output_file)
+    metrics.write_summary(os.path.join(os.path.dirname(os.path.abspath(output_file)), METRICS_SUMMARY_NAME))
+
 if __name__ == "__main__":
     input_file = input("Please enter the path to the Chinese text file: ").strip()
-    
+
     if not os.path.exists(input_file):
         print(f"Error: The file '{input_file}' does not exist.")
     else:
         output_file = get_output_filename(input_file)
-        translate_file(input_file, output_file)
-        print(f"\nTranslation complete. Output saved to {output_file}")
\ No newline at end of file
+        asyncio.run(main(input_file, output_file))
+        print(f"\nTranslation complete. Output saved to {output_file}")
@@ -0,0 +1,163 @@
+import os
+import re
+import sys
+import json
+import time
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+from media_inventory import load_inventory
+from token_estimate import CJK_RE
+from cascade import CJK_RESIDUE_MAX
+
+# Checks every translated title in the tree against its source SRT: for each
+# .srt with a _en.vtt and a _vn.vtt (or _vi.vtt) next to it, the targets must
+# have the same cues at the same times, no empty cues where the source has
+# text, no cue still mostly in Chinese and no TRANSLATION_FAILED markers. Titles
+# are spread over a process pool and the findings written as one JSON report;
+# the exit status is 1 when any title has an issue.
+REPORT_NAME = "subtitle_report.json"
+TARGETS = (('en', ('en_vtt',)), ('vi', ('vn_vtt', 'vi_vtt')))  # Language -> inventory keys, first match wins
+TIMESTAMP_TOLERANCE_MS = 10  # Rounding between SRT and VTT writers
+FAILED_MARKER = "TRANSLATION_FAILED"
+MAX_EXAMPLES = 5  # Cue indexes listed per issue
+
+# A timing line ("[hh:]mm:ss,mmm --> [hh:]mm:ss,mmm", comma or dot) and the non-blank
+# lines after it. One pass over the whole file is much faster than splitting blocks.
+CUE_RE = re.compile(
+    r'^(?:(\d+):)?(\d{1,2}):(\d{2})[,.](\d{3})[ \t]*-->[ \t]*(?:(\d+):)?(\d{1,2}):(\d{2})[,.](\d{3})[^\n]*\n?'
+    r'((?:[^\n]*\S[^\n]*(?:\n|$))*)', re.MULTILINE)
+
+def timestamp_ms(hours, minutes, seconds, millis):
+    return ((int(hours or 0) * 60 + int(minutes)) * 60 + int(seconds)) * 1000 + int(millis)
+
+def parse_cues(path):
+    """
+    Return [(timing, text)] for the cues of an SRT or VTT file, timing being the
+    eight matched fields of the start and end times.
+    """
+    with open(path, 'r', encoding='utf-8-sig', errors='replace') as f:
+        content = f.read().replace('\r\n', '\n')
+    return [(match.groups()[:8], match.group(9).strip()) for match in CUE_RE.finditer(content)]
+
+def aligned(source_timing, target_timing):
+    if source_timing == target_timing:
+        return True
+    # Written differently (hours left out, another separator) or shifted: compare in milliseconds
+    return (abs(timestamp_ms(*source_timing[:4]) - timestamp_ms(*target_timing[:4])) <= TIMESTAMP_TOLERANCE_MS
+            and abs(timestamp_ms(*source_timing[4:]) - timestamp_ms(*target_timing[4:])) <= TIMESTAMP_TOLERANCE_MS)
+
+def examples(indexes):
+    return indexes[:MAX_EXAMPLES]
+
+def compare_cues(source, target):
+    """
+    Return the issues of one target file against its source cues.
+    """
+    issues = []
+    if len(source) != len(target):
+        issues.append({"check": "cue_count", "source": len(source), "target": len(target)})
+
+    misaligned = [i for i, (s, t) in enumerate(zip(source, target)) if not aligned(s[0], t[0])]
+    if misaligned:
+        issues.append({"check": "timestamps", "count": len(misaligned), "cues": examples(misaligned)})
+
+    empty = [i for i, (s, t) in enumerate(zip(source, target)) if s[1] and not t[1]]
+    if empty:
+        issues.append({"check": "empty_cues", "count": len(empty), "cues": examples(empty)})
+
+    residue = []
+    failed = []
+    for i, (_, text) in enumerate(target):
+        if FAILED_MARKER in text:
+            failed.append(i)
+        elif CJK_RE.search(text):
+            chars = ''.join(text.split())
+            if len(CJK_RE.findall(chars)) / len(chars) > CJK_RESIDUE_MAX:
+                residue.append(i)
+    if residue:
+        issues.append({"check": "cjk_residue", "count": len(residue), "cues": examples(residue)})
+    if failed:
+        issues.append({"check": "translation_failed", "count": len(failed), "cues": examples(failed)})
+    return issues
+
+def verify_title(title):
+    """
+    Verify one title (an entry of MediaInventory.titles() with an SRT) and return
+    its report entries, one per target language.
+    """
+    results = []
+    try:
+        source = parse_cues(title['srt']['path'])
+    except OSError as e:
+        return [{"srt": title['srt']['path'], "lang": None, "target": None,
+                 "issues": [{"check": "unreadable", "error": str(e)}]}]
+
+    for lang, keys in TARGETS:
+        target = next((title[key] for key in keys if title[key] is not None), None)
+        entry = {"srt": title['srt']['path'], "lang": lang, "target": target['path'] if target else None}
+        if target is None:
+            entry["issues"] = [{"check": "missing_target"}]
+        else:
+            try:
+                entry["issues"] = compare_cues(source, parse_cues(target['path']))
+            except OSError as e:
+                entry["issues"] = [{"check": "unreadable", "error": str(e)}]
+        entry["cues"] = len(source)
+        results.append(entry)
+    return results
+
+def verify_titles(titles):
+    # One task per chunk of titles: per-title tasks would spend more on pickling than on checking
+    return [entry for title in titles for entry in verify_title(title)]
+
+def verify_tree(root_dir, workers=None, full=False, include_clean=False):
+    started = time.monotonic()
+    titles = [title for title in load_inventory(root_dir, full).titles() if title['srt'] is not None]
+    workers = workers or os.cpu_count() or 1
+    chunk = max(1, min(256, len(titles) // (workers * 4) or 1))
+    chunks = [titles[i:i + chunk] for i in range(0, len(titles), chunk)]
+    if workers == 1 or len(chunks) == 1:
+        entries = [entry for part in chunks for entry in verify_titles(part)]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            entries = [entry for part in executor.map(verify_titles, chunks) for entry in part]
+
+    summary = {}
+    for entry in entries:
+        for issue in entry["issues"]:
+            summary[issue["check"]] = summary.get(issue["check"], 0) + 1
+    flagged = [entry for entry in entries if entry["issues"]]
+    return {
+        "root": os.path.abspath(root_dir),
+        "titles": len(titles),
+        "files_checked": len(titles) + sum(1 for entry in entries if entry["target"]),
+        "targets_with_issues": len(flagged),
+        "issues": summary,
+        "elapsed_seconds": round(time.monotonic() - started, 2),
+        "results": entries if include_clean else flagged,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Verify every SRT/VTT translation triple under a folder.")
+    parser.add_argument("root", nargs="?", default=os.getcwd(), help="folder to check (default: current folder)")
+    parser.add_argument("-o", "--output", help=f"report path, '-' for stdout (default: {REPORT_NAME} in the root)")
+    parser.add_argument("-j", "--workers", type=int, help="worker processes (default: one per CPU)")
+    parser.add_argument("--full", action="store_true", help="rescan the whole tree instead of trusting the media inventory cache")
+    parser.add_argument("--all", action="store_true", help="list clean targets in the report too")
+    args = parser.parse_args()
+
+    report = verify_tree(args.root, args.workers, args.full, args.all)
+    output = args.output or os.path.join(args.root, REPORT_NAME)
+    if output == '-':
+        json.dump(report, sys.stdout, ensure_ascii=False, indent=2)
+        print()
+    else:
+        with open(output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        issues = ', '.join(f"{check} {count}" for check, count in sorted(report["issues"].items())) or "none"
+        print(f"Checked {report['files_checked']} files of {report['titles']} titles in {report['elapsed_seconds']}s: "
+              f"{report['targets_with_issues']} targets with issues ({issues}). Report: {output}", file=sys.stderr)
+    sys.exit(1 if report["targets_with_issues"] else 0)
+
+if __name__ == "__main__":
+    main()